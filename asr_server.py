@@ -0,0 +1,292 @@
+# *-* coding: utf-8 *-*
+"""
+Warm local transcription service, one ASR pipeline stays loaded and segments from concurrent callers are merged into dynamic batches.
+
+    POST /transcribe   body: mono float32 little-endian PCM of one segment at 16 kHz -> {"text": ..., ("chunks": ...)}
+    GET  /metrics      queue depth, batch sizes and latency percentiles
+    GET  /health
+
+A batch is sent to the model when it is full (max_batch_size) or when its oldest segment waited max_wait seconds.
+The model is any callable taking a list of {'raw': ndarray, 'sampling_rate': int} and returning one result dict per item,
+by default the transformers pipeline of caption.ASRInference, stub_model stands in for it to exercise the batching without a GPU.
+"""
+import json
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.request import Request, urlopen
+from logging import getLogger, basicConfig, DEBUG
+
+import numpy as np
+
+from utils import SAMPLE_RATE
+
+basicConfig(level=DEBUG)
+logger = getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # many callers connect at once, the default backlog of 5 resets their connections
+    request_queue_size = 256
+
+def asr_model(model_id: str = None, model_path: str = None, batch_size: int = 16, return_timestamps: bool | str = None):
+    """
+    the ASRInference transformers pipeline as a batch callable, loaded once
+    """
+    from caption import ASRInference
+    asr = ASRInference(model_id=model_id, model_path=model_path, batch_size=batch_size)
+    pipe_kwargs = {} if return_timestamps is None else {"return_timestamps": return_timestamps}
+    return lambda batch: asr.pipe(batch, generate_kwargs=asr.generate_kwargs, **pipe_kwargs)
+
+def stub_model(batch_cost: float = 0.05, item_cost: float = 0.002):
+    """
+    stand-in model with a fixed cost per call plus a small cost per item (like a GPU forward pass), the text reports the batch it ran in
+    """
+    calls = iter(range(1, 1 << 62))
+    def model(batch):
+        call = next(calls)
+        time.sleep(batch_cost + item_cost * len(batch))
+        return [{'text': f"{len(item['raw']) / item['sampling_rate']:.2f}s batch {call} of {len(batch)}"} for item in batch]
+    return model
+
+class DynamicBatcher:
+    """
+    Single worker thread feeding the model, submit() returns a Future resolved with the item's result
+    """
+    def __init__(self, model, max_batch_size: int = 16, max_wait: float = 0.05, window: int = 1000):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.model_seconds = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, raw: np.ndarray, sampling_rate: int = SAMPLE_RATE) -> Future:
+        future = Future()
+        with self.lock:
+            if not self.running:
+                future.set_exception(RuntimeError("batcher stopped"))
+                return future
+            self.queue.put(({'raw': raw, 'sampling_rate': sampling_rate}, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        """
+        block for the first item, then take more until the batch is full or the first item's deadline passed
+        """
+        try:
+            first = self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                results = self.model([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"model returned {len(results)} results for {len(batch)} segments")
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {e}")
+                with self.lock:
+                    self.errors += len(batch)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            with self.lock:
+                self.model_seconds += done - start
+                self.batch_sizes.append(len(batch))
+                self.requests += len(batch)
+                self.latencies.extend(done - queued for _, _, queued in batch)
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stop(self):
+        """
+        stop the worker after its current batch, items still queued fail so no caller waits on them forever
+        """
+        with self.lock:
+            self.running = False
+        self.thread.join()
+        while True:
+            try:
+                _, future, _ = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(RuntimeError("batcher stopped"))
+
+    def metrics(self) -> dict:
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = list(self.batch_sizes)
+            metrics = {
+                'queue_depth': self.queue.qsize(),
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': len(batch_sizes),
+                'mean_batch_size': float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+                'model_seconds': round(self.model_seconds, 3),
+            }
+        for name, q in (('p50', 50), ('p95', 95), ('max', 100)):
+            metrics[f'latency_{name}_ms'] = round(float(np.percentile(latencies, q)), 2) if len(latencies) else 0.0
+        return metrics
+
+class TranscriptionServer:
+    """
+    Threaded localhost http server around a DynamicBatcher, usable as a context manager (serves in a background thread),
+    or run serve_forever() in the foreground. port 0 picks a free port, see `url`.
+    """
+    def __init__(self, model, host: str = '127.0.0.1', port: int = DEFAULT_PORT, max_batch_size: int = 16, max_wait: float = 0.05):
+        self.batcher = DynamicBatcher(model, max_batch_size, max_wait)
+        batcher = self.batcher
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send_json(self, status: int, payload):
+                body = json.dumps(payload, ensure_ascii=False, default=float).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    self._send_json(200, batcher.metrics())
+                elif self.path == '/health':
+                    self._send_json(200, {'status': 'ok'})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                if self.path != '/transcribe':
+                    self.send_error(404)
+                    return
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not data or len(data) % 4:
+                    self._send_json(400, {'error': "body must be float32 pcm"})
+                    return
+                try:
+                    result = batcher.submit(np.frombuffer(data, dtype='<f4')).result()
+                except Exception as e:
+                    self._send_json(500, {'error': str(e)})
+                    return
+                self._send_json(200, result)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Server((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = None
+
+    def serve_forever(self):
+        logger.info(f"Transcription server on {self.url}")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        self.httpd.server_close()
+        self.batcher.stop()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.thread.join()
+        self.close()
+
+def transcribe(raw: np.ndarray, url: str = f"http://127.0.0.1:{DEFAULT_PORT}", timeout: float = 600) -> dict:
+    """
+    client: transcribe one 16 kHz mono segment on a running server
+    """
+    request = Request(f"{url}/transcribe", data=np.asarray(raw, dtype='<f4').tobytes(), method='POST',
+                      headers={'Content-Type': 'application/octet-stream'})
+    with urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def transcribe_segments(audio, vad_segments, url: str = f"http://127.0.0.1:{DEFAULT_PORT}", concurrency: int = 16, pcm_cache=None):
+    """
+    client: transcribe the vad segments of an audio file, segments are sent concurrently so the server can batch them,
+    return results in the same form as ASRInference.inference
+    """
+    from segments import offset_chunks, read_segments
+    from audio_cache import PCMCache
+    pcm_cache = PCMCache() if pcm_cache is None else pcm_cache
+    pcm = pcm_cache.load(audio)
+    segments = list(read_segments(vad_segments))
+    def request(segment):
+        raw = pcm[int(segment.start * SAMPLE_RATE):int(segment.end * SAMPLE_RATE)]
+        item = {'start_time': segment.start, 'end_time': segment.end, **transcribe(raw, url)}
+        if 'chunks' in item:
+            item['chunks'] = offset_chunks(item['chunks'], segment.start, segment.end)
+        return item
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(request, segments))
+
+def benchmark_clients(clients: int = 32, requests_per_client: int = 8, max_batch_size: int = 16, max_wait: float = 0.05, batch_cost: float = 0.05):
+    """
+    many small callers against one server with the stub model, return the server metrics and wall time
+    """
+    rng = np.random.default_rng(0)
+    segments = [rng.standard_normal(int(SAMPLE_RATE * rng.uniform(1, 5))).astype(np.float32) for _ in range(clients * requests_per_client)]
+    with TranscriptionServer(stub_model(batch_cost), port=0, max_batch_size=max_batch_size, max_wait=max_wait) as server:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as pool:
+            results = list(pool.map(lambda raw: transcribe(raw, server.url), segments))
+        wall = time.perf_counter() - start
+        with urlopen(f"{server.url}/metrics") as response:
+            metrics = json.loads(response.read())
+    assert len(results) == len(segments) and all('text' in result for result in results)
+    # sequential unbatched calls would cost batch_cost per segment
+    return {'clients': clients, 'segments': len(segments), 'wall_seconds': round(wall, 3),
+            'unbatched_seconds': round(len(segments) * batch_cost, 3), **metrics}
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="warm local transcription server with dynamic batching")
+    parser.add_argument('--model-id', default=None)
+    parser.add_argument('--model-path', default=None)
+    parser.add_argument('--stub', action='store_true', help="serve the stub model instead of loading an asr model")
+    parser.add_argument('--benchmark', action='store_true', help="run concurrent clients against a stub model server and print its metrics")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait', type=float, default=0.05, help="seconds a segment may wait for its batch to fill")
+    parser.add_argument('--timestamps', default=None, choices=('chunk', 'word'))
+    args = parser.parse_args()
+    if args.benchmark:
+        for clients in (1, 4, 16, 64):
+            print(benchmark_clients(clients, max_batch_size=args.max_batch_size, max_wait=args.max_wait))
+    else:
+        timestamps = {None: None, 'chunk': True, 'word': 'word'}[args.timestamps]
+        model = stub_model() if args.stub else asr_model(args.model_id, args.model_path, args.max_batch_size, timestamps)
+        TranscriptionServer(model, port=args.port, max_batch_size=args.max_batch_size, max_wait=args.max_wait).serve_forever()
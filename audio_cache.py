@@ -0,0 +1,104 @@
+# *-* coding: utf-8 *-*
+"""
+Decoded audio cache, each source is decoded once to 16 kHz mono float32 PCM and memory-mapped by every stage
+(VAD windows, ASR segment slices, split clips), so slicing is free and multi-hour files are paged in on demand instead of loaded.
+Entries are keyed by the source path, size and mtime (no pass over the file content): '<key>.f32' (raw little-endian float32) and
+'<key>.json' (metadata), the metadata is written last, an entry without it is incomplete and decoded again.
+When a source changes, the entries of its previous version are removed on the next decode.
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from logging import getLogger, basicConfig, DEBUG
+
+import numpy as np
+
+from utils import stream_pcm, SAMPLE_RATE
+
+basicConfig(level=DEBUG)
+logger = getLogger(__name__)
+
+CACHE_DIR = '.pcm_cache'
+DECODE_BLOCK = SAMPLE_RATE * 60
+
+class PCMCache:
+    """
+    cache_dir: folder holding the decoded PCM, default is '.pcm_cache' next to each source audio
+    """
+    def __init__(self, cache_dir: str | Path = None, sample_rate: int = SAMPLE_RATE):
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.sample_rate = sample_rate
+
+    @staticmethod
+    def _source_key(audio: Path) -> str:
+        return hashlib.sha1(str(audio.resolve()).encode('utf-8')).hexdigest()[:16]
+
+    def _key(self, audio: Path) -> str:
+        stat = audio.stat()
+        version = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()[:16]
+        return f'{self._source_key(audio)}_{version}_{self.sample_rate}'
+
+    def paths(self, audio: str | Path) -> tuple[Path, Path]:
+        """
+        (pcm path, metadata path) of the cache entry of audio
+        """
+        audio = Path(audio)
+        cache_dir = audio.parent / CACHE_DIR if self.cache_dir is None else self.cache_dir
+        key = self._key(audio)
+        return cache_dir / f'{key}.f32', cache_dir / f'{key}.json'
+
+    def _decode(self, audio: Path, pcm_path: Path, meta_path: Path) -> dict:
+        logger.info(f"Decoding {audio} to {pcm_path}")
+        pcm_path.parent.mkdir(parents=True, exist_ok=True)
+        # pid in the temporary name, concurrent processes decoding the same source don't write into each other
+        tmp = pcm_path.with_name(f'.{pcm_path.name}.{os.getpid()}.tmp')
+        num_samples = 0
+        try:
+            with open(tmp, 'wb') as f:
+                for block in stream_pcm(audio, DECODE_BLOCK, self.sample_rate):
+                    f.write(block.astype('<f4', copy=False).tobytes())
+                    num_samples += len(block)
+            os.replace(tmp, pcm_path)
+        finally:
+            # a failed or interrupted decode leaves no partial file behind
+            tmp.unlink(missing_ok=True)
+        for stale in pcm_path.parent.glob(f'{self._source_key(audio)}_*_{self.sample_rate}.*'):
+            if stale.stem != pcm_path.stem:
+                stale.unlink(missing_ok=True)
+        meta = {'source': str(audio), 'sample_rate': self.sample_rate, 'num_samples': num_samples, 'dtype': '<f4'}
+        tmp = meta_path.with_name(f'.{meta_path.name}.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps(meta), encoding='utf-8')
+        os.replace(tmp, meta_path)
+        return meta
+
+    def load(self, audio: str | Path) -> np.ndarray:
+        """
+        Read-only memory-mapped mono PCM of audio at sample_rate, decoded on first use
+        """
+        audio = Path(audio)
+        pcm_path, meta_path = self.paths(audio)
+        if meta_path.exists() and pcm_path.exists():
+            meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        else:
+            meta = self._decode(audio, pcm_path, meta_path)
+        if meta['num_samples'] == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.memmap(pcm_path, dtype=meta['dtype'], mode='r', shape=(meta['num_samples'],))
+
+    def blocks(self, audio: str | Path, block_samples: int):
+        """
+        yield the cached PCM in blocks of block_samples, a drop-in for utils.stream_pcm
+        """
+        pcm = self.load(audio)
+        for start in range(0, len(pcm), block_samples):
+            yield pcm[start:start + block_samples]
+
+    def slice(self, audio: str | Path, start_time: float, end_time: float) -> np.ndarray:
+        """
+        PCM between start_time and end_time in seconds, clipped to the audio, a view of the memory map
+        """
+        pcm = self.load(audio)
+        start = max(int(start_time * self.sample_rate), 0)
+        end = min(int(end_time * self.sample_rate), len(pcm))
+        return pcm[start:max(start, end)]
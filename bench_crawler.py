@@ -0,0 +1,157 @@
+"""
+Local stand-in for hvdb, serves fixture pages with the same selectors the crawler uses, with an artificial per-request latency.
+Run as a script to measure crawler throughput for several concurrency settings, and pages/s and peak memory of the browser and http fetch modes.
+"""
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+WORKS_PER_PAGE = 5
+SCRIPTS_PER_WORK = 4
+
+def _html(body: str) -> bytes:
+    return f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>hvdb</title></head><body>{body}</body></html>".encode('utf-8')
+
+def fixture_page(path: str, query: dict, rendered: bool = False) -> bytes | None:
+    """
+    Render the fixture page for a request path, None for unknown paths.
+    Works with an id divisible by 7 have a script without japanese text, works with an id divisible by 11 render their script pages
+    with javascript, the static html is an empty shell unless rendered (what a browser would see) is set.
+    """
+    parts = [part for part in path.split('/') if part]
+    if not parts:
+        page = int(query.get('page', ['1'])[0])
+        links = ''.join(f"<a href='/Dashboard/Details/{page * 100 + i}'>work {page * 100 + i}</a>" for i in range(WORKS_PER_PAGE))
+        return _html(f"<div class='list'>{links}</div>")
+    if parts[:2] == ['Dashboard', 'Details']:
+        work = int(parts[2])
+        return _html(f"<h2>RJ{work:08d} テスト作品</h2><a class='btn btn-default' href='/Dashboard/ScriptList/{work}'>View Scripts</a>")
+    if parts[:2] == ['Dashboard', 'ScriptList']:
+        work = int(parts[2])
+        links = ''.join(f"<li><a href='/Dashboard/Script/{work}/{i}'>トラック{i}: タイトル?</a></li>" for i in range(1, SCRIPTS_PER_WORK + 1))
+        return _html(f"<ul>{links}</ul>")
+    if parts[:2] == ['Dashboard', 'Script']:
+        work, track = int(parts[2]), int(parts[3])
+        if work % 11 == 0 and not rendered:
+            return _html("<div id='app'></div><script src='/static/script.js'></script>")
+        if work % 7 == 0 and track == SCRIPTS_PER_WORK:
+            return _html("<div class='row engScript'><p>english only</p></div>")
+        text = f"作品{work}のトラック{track}です。\nおはようございます、ご主人様。"
+        if track % 2:
+            return _html(f"<div class='row japScript'><div><p>{text}</p></div></div>")
+        return _html(f"<div class='row bothScript'><div><p class='double-box'>{text}</p></div><div><p class='double-box'>english</p></div></div>")
+    return None
+
+class _Server(ThreadingHTTPServer):
+    # the default backlog of 5 drops connections of a concurrent crawl, they are retried after a second and skew the timings
+    request_queue_size = 128
+    daemon_threads = True
+
+class FixtureServer:
+    """
+    Threaded fixture http server on localhost, usable as a context manager, `url` is the base url to pass to the crawler
+    """
+    def __init__(self, latency: float = 0.05):
+        latency_s = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                url = urlparse(self.path)
+                body = fixture_page(url.path, parse_qs(url.query))
+                time.sleep(latency_s)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Server(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def benchmark_concurrency(pages: int = 2, latency: float = 0.05, settings=((1, 1, 1, 1), (8, 2, 4, 8), (16, 2, 8, 16)), fetch_mode: str = 'browser'):
+    """
+    Crawl `pages` fixture list pages for each (pool_size, list, details, script) concurrency setting, return rows of pages/s
+    """
+    from crawler_hvdb import scrape_rj_codes
+    from corpus import CorpusStore
+    rows = []
+    with FixtureServer(latency) as server:
+        for pool_size, list_c, details_c, script_c in settings:
+            out_dir = Path(tempfile.mkdtemp())
+            server.requests = 0
+            start = time.perf_counter()
+            scrape_rj_codes(1, pages, base_url=server.url, out_dir=out_dir, pool_size=pool_size,
+                            list_concurrency=list_c, details_concurrency=details_c, script_concurrency=script_c, fetch_mode=fetch_mode)
+            elapsed = time.perf_counter() - start
+            with CorpusStore(out_dir / 'corpus.sqlite3') as corpus:
+                works = len(corpus.rj_codes())
+            rows.append({'fetch_mode': fetch_mode, 'pool_size': pool_size, 'concurrency': (list_c, details_c, script_c), 'requests': server.requests,
+                         'works': works, 'elapsed': elapsed, 'pages_per_s': server.requests / elapsed})
+            shutil.rmtree(out_dir)
+    return rows
+
+def _peak_rss_mb():
+    """
+    peak resident memory of this process and of its largest reaped child (chromium), in MB
+    """
+    import resource
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KB on linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return self_rss / scale, children_rss / scale
+
+def benchmark_fetch_modes(pages: int = 2, latency: float = 0.05, modes=('browser', 'http')):
+    """
+    Compare fetch modes at the same concurrency, each mode runs in a fresh interpreter so the peak memory numbers don't mix
+    """
+    import subprocess
+    rows = []
+    for mode in modes:
+        cmd = [sys.executable, __file__, '--pages', str(pages), '--latency', str(latency), '--single-mode', mode]
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        rows.append(json.loads(output.strip().splitlines()[-1]))
+    return rows
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="crawler throughput against a local fixture server")
+    parser.add_argument('--pages', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05, help="per request latency in seconds")
+    parser.add_argument('--single-mode', default=None, help="internal: run one fetch mode and print a json row")
+    args = parser.parse_args()
+    if args.single_mode:
+        row = benchmark_concurrency(args.pages, args.latency, settings=((8, 2, 4, 8),), fetch_mode=args.single_mode)[0]
+        row['peak_rss_mb'], row['peak_children_rss_mb'] = _peak_rss_mb()
+        print(json.dumps(row))
+    else:
+        for row in benchmark_concurrency(args.pages, args.latency):
+            print(row)
+        for row in benchmark_fetch_modes(args.pages, args.latency):
+            print(row)
@@ -0,0 +1,274 @@
+"""
+Reproducible benchmarks of the CPU heavy text stages: preprocess_text, segment_to_words, OnomatopoeiaPatternMatcher.is_match, postprocess_text,
+JapaneseTextAligner.align_text and compare_texts_char_level_with_positions.
+Inputs are synthetic japanese scripts (seeded) with a configurable onomatopoeia density, and matching TextGrids of their words with
+controlled insertion / deletion noise, every stage is timed at several script sizes.
+Run as a script to print the timings, --save-baseline writes them as the baseline, --baseline compares against one and exits non-zero
+when a stage got slower than the threshold or scales worse than in the baseline. The committed bench_text_baseline.json is the default
+baseline, so the CI gate is plain `python bench_text.py`, refresh it with `python bench_text.py --save-baseline bench_text_baseline.json`
+after an intended change.
+Times are normalized by a fixed pure python calibration workload run right after every stage run, so baselines roughly carry over between machines.
+Every stage is timed in several interleaved rounds, a stage counts as slower only when the geometric mean over the sizes of its normalized
+times is more than the threshold above the baseline medians in most rounds.
+Noise floor, measured as six runs of an unchanged tree compared pairwise on a shared single vCPU VM: single (stage, size) medians differ
+by up to 1.4x, stage geometric means by up to 1.3x (align_text, which writes files) and within 1.2x for the other stages, scaling
+exponents by up to 0.17. The default threshold of 35% and scaling margin of 0.3 sit above that, a quiet machine allows tighter ones.
+"""
+import sys
+import json
+import math
+import time
+import random
+import statistics
+import logging
+import tempfile
+from pathlib import Path
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+ONOMATO_FILE = Path(__file__).parent / 'onomato.txt'
+SIZES = (100, 400, 1600)
+BASELINE = Path(__file__).with_name('bench_text_baseline.json')
+STAGES = ('preprocess_text', 'segment_to_words', 'is_match', 'postprocess_text', 'align_text', 'compare_texts')
+
+WORDS = [
+    '今日', 'は', 'とても', '気持ち', 'いい', 'ですね', 'お兄ちゃん', '一緒に', '寝よう', '耳かき', 'します', 'ゆっくり', '休んで', 'ください',
+    '大丈夫', 'ですよ', 'ここ', '好き', 'なの', 'かな', 'もう少し', '奥まで', 'マッサージ', 'しましょう', 'お疲れ様', 'でした', '明日', 'も',
+    '頑張って', 'ね', '私', 'の', '声', 'を', '聞いて', '眠く', 'なって', 'きた', '右耳', '左耳', '綺麗', 'に', 'なりました', '温かい', 'タオル',
+]
+DECORATIONS = ['♡', '♪', '…', '　']
+NOTES = ['（小声で）', '【効果音】', '(囁き)', '〈右から〉']
+
+def _onomatopoeias() -> list[str]:
+    return [line.strip() for line in ONOMATO_FILE.read_text(encoding='utf-8').splitlines() if line.strip()]
+
+def synthetic_script(num_lines: int, onomato_density: float = 0.2, seed: int = 0) -> str:
+    """
+    num_lines script lines of random phrases, each phrase is an onomatopoeia with probability onomato_density,
+    with decorations, bracketed notes and blank lines like crawled scripts
+    """
+    rng = random.Random(seed)
+    onomatopoeias = _onomatopoeias()
+    lines = []
+    for _ in range(num_lines):
+        phrases = []
+        for _ in range(rng.randint(1, 4)):
+            if rng.random() < onomato_density:
+                phrases.append(rng.choice(onomatopoeias))
+            else:
+                phrases.append(''.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))))
+            if rng.random() < 0.15:
+                phrases[-1] += rng.choice(DECORATIONS)
+        line = '、'.join(phrases) + rng.choice('。。！？…')
+        if rng.random() < 0.05:
+            line = rng.choice(NOTES) + line
+        lines.append(line)
+        if rng.random() < 0.1:
+            lines.append('')
+    return '\n'.join(lines) + '\n'
+
+def add_noise(text: str, insert_rate: float = 0.02, delete_rate: float = 0.02, seed: int = 0) -> str:
+    """
+    delete / insert random characters at the given per character rates, like a recognizer's errors
+    """
+    rng = random.Random(seed)
+    chars = []
+    for char in text:
+        if char != '\n' and rng.random() < delete_rate:
+            continue
+        chars.append(char)
+        if rng.random() < insert_rate:
+            chars.append(rng.choice('あいうえおかきくけこんっー'))
+    return ''.join(chars)
+
+def synthetic_textgrid(text: str, path: str | Path, insert_rate: float = 0.0, delete_rate: float = 0.02, seed: int = 0) -> Path:
+    """
+    Write a word tier TextGrid for the script lines as a forced aligner would, words are 1 to 4 normalized characters,
+    each word is dropped with delete_rate and a spurious word inserted after it with insert_rate.
+    A forced aligner only emits transcript words, and inserted words derail align_text for every following line, so insertions are off by default.
+    """
+    import textgrid
+    from force_align import JapaneseTextAligner
+    rng = random.Random(seed)
+    aligner = JapaneseTextAligner()
+    intervals = []
+    now = 0.5
+    for line in text.splitlines():
+        chars = aligner._normalize_japanese(aligner._filter_non_japanese(line))
+        position = 0
+        while position < len(chars):
+            size = rng.randint(1, 4)
+            word = chars[position:position + size]
+            position += size
+            duration = 0.08 * len(word)
+            if rng.random() >= delete_rate:
+                intervals.append((now, now + duration, word))
+            now += duration
+            if rng.random() < insert_rate:
+                intervals.append((now, now + 0.1, rng.choice(['えっと', 'あの', 'ん'])))
+                now += 0.1
+        now += 0.8
+    tier = textgrid.IntervalTier('words', 0.0, now)
+    for start, end, word in intervals:
+        tier.add(round(start, 3), round(end, 3), word)
+    grid = textgrid.TextGrid('synthetic', 0.0, now)
+    grid.append(tier)
+    path = Path(path)
+    with open(path, 'w', encoding='utf-8') as f:
+        grid.write(f)
+    return path
+
+def _calibration_workload():
+    counts = {}
+    for i in range(50000):
+        key = str(i % 997)
+        counts[key] = counts.get(key, 0) + len(key)
+    return counts
+
+def _best_of(func, repeat: int, min_time: float = 0.3) -> tuple[float, float]:
+    """
+    (fastest of at least repeat runs of func, fastest calibration run), short functions run until min_time seconds were spent.
+    the calibration workload runs right after every run of func, the machine speed drifts within a fraction of a second here,
+    so only minimums taken over the same stretch of time are comparable
+    """
+    best, unit, spent, runs = math.inf, math.inf, 0.0, 0
+    while runs < repeat or spent < min_time:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        _calibration_workload()
+        calibration = time.perf_counter() - start
+        best, unit, spent, runs = min(best, elapsed), min(unit, calibration), spent + elapsed + calibration, runs + 1
+    return best, unit
+
+def _stage_runs(size: int, tmp: Path, matcher, onomato_density: float, insert_rate: float, delete_rate: float,
+                tg_insert_rate: float, tg_delete_rate: float, seed: int) -> dict:
+    """
+    the synthetic inputs of one size and a callable per stage running on them
+    """
+    from onomato import preprocess_text, segment_to_words, postprocess_text, compare_texts_char_level_with_positions, Japanese_characters, Full_width_alpnums
+    import regex as re
+    from force_align import JapaneseTextAligner
+    script = synthetic_script(size, onomato_density, seed)
+    preprocessed = preprocess_text(script)
+    segments = segment_to_words(preprocessed)
+    words = [re.sub(f"[^{Japanese_characters}{Full_width_alpnums}]", "", segment) for segment in segments]
+    postprocessed = postprocess_text(preprocessed)
+    noisy = add_noise(postprocessed, insert_rate, delete_rate, seed)
+    tg_path = synthetic_textgrid(postprocessed, tmp / f'bench_{size}.TextGrid', tg_insert_rate, tg_delete_rate, seed)
+    return {
+        'preprocess_text': lambda: preprocess_text(script),
+        'segment_to_words': lambda: segment_to_words(preprocessed),
+        'is_match': lambda: [matcher.is_match(word) for word in words],
+        'postprocess_text': lambda: postprocess_text(preprocessed),
+        'align_text': lambda: JapaneseTextAligner().align_text(tg_path, postprocessed, overwrite=True),
+        'compare_texts': lambda: compare_texts_char_level_with_positions(postprocessed, noisy),
+    }
+
+def benchmark_stages(sizes=SIZES, onomato_density: float = 0.2, insert_rate: float = 0.02, delete_rate: float = 0.02,
+                     tg_insert_rate: float = 0.0, tg_delete_rate: float = 0.02, repeat: int = 5, rounds: int = 5, seed: int = 0):
+    """
+    Time every stage at every size (script lines), return {stage: {size: [(seconds, calibration seconds) per round]}}
+    insert_rate / delete_rate: character noise of the text compare_texts compares the script to, tg_*: word noise of the TextGrid
+    the whole grid is timed in `rounds` interleaved rounds of best of `repeat` runs, so a slow phase of the machine only spoils one round
+    """
+    from onomato import OnomatopoeiaPatternMatcher
+    matcher = OnomatopoeiaPatternMatcher(ONOMATO_FILE)
+    samples = {stage: {str(size): [] for size in sizes} for stage in STAGES}
+    # the stages log per line, which would dominate the timings
+    logging.disable(logging.CRITICAL)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            runs = {size: _stage_runs(size, Path(tmp), matcher, onomato_density, insert_rate, delete_rate, tg_insert_rate, tg_delete_rate, seed) for size in sizes}
+            for _ in range(rounds):
+                for size in sizes:
+                    for stage in STAGES:
+                        samples[stage][str(size)].append(_best_of(runs[size][stage], repeat))
+    finally:
+        logging.disable(logging.NOTSET)
+    return samples
+
+def scaling_exponent(stage_timings: dict) -> float:
+    """
+    least squares slope of log(time) over log(size), 1.0 is linear, 2.0 quadratic
+    """
+    points = [(math.log(int(size)), math.log(max(seconds, 1e-9))) for size, seconds in stage_timings.items()]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / sum((x - mean_x) ** 2 for x, _ in points)
+
+def _geometric_mean(values) -> float:
+    values = list(values)
+    return math.exp(sum(math.log(max(value, 1e-12)) for value in values) / len(values))
+
+def run_benchmark(**kwargs) -> dict:
+    samples = benchmark_stages(**kwargs)
+    rounds = {stage: {size: [seconds / unit for seconds, unit in values] for size, values in sizes.items()} for stage, sizes in samples.items()}
+    normalized = {stage: {size: statistics.median(values) for size, values in sizes.items()} for stage, sizes in rounds.items()}
+    return {
+        'params': kwargs,
+        'calibration': statistics.median(unit for sizes in samples.values() for values in sizes.values() for _, unit in values),
+        'timings': {stage: {size: statistics.median(seconds for seconds, _ in values) for size, values in sizes.items()} for stage, sizes in samples.items()},
+        'normalized': normalized,
+        'rounds': rounds,
+        'scaling': {stage: scaling_exponent(sizes) for stage, sizes in normalized.items()},
+    }
+
+def compare(result: dict, baseline: dict, threshold: float = 0.35, scaling_margin: float = 0.3) -> list[str]:
+    """
+    regressions of result against baseline: a stage whose normalized time, as geometric mean over the sizes, is more than threshold slower
+    than the baseline medians in most rounds, or a scaling exponent more than scaling_margin steeper
+    """
+    regressions = []
+    for stage, sizes in baseline['normalized'].items():
+        # sizes are str keys once a result went through json
+        sizes = {str(size): value for size, value in sizes.items()}
+        current = {str(size): values for size, values in result['rounds'].get(stage, {}).items()}
+        normalized = {str(size): value for size, value in result['normalized'].get(stage, {}).items()}
+        common = [size for size in sizes if current.get(size)]
+        if common:
+            ratios = [_geometric_mean(value / sizes[size] for size, value in zip(common, values))
+                      for values in zip(*(current[size] for size in common))]
+            slower = sum(ratio > 1 + threshold for ratio in ratios)
+            if slower > len(ratios) / 2:
+                per_size = ', '.join(f"{size}: {normalized[size] / sizes[size]:.2f}x" for size in common)
+                regressions.append(f"{stage}: {statistics.median(ratios):.2f}x baseline in {slower}/{len(ratios)} rounds ({per_size})")
+        base_scaling, scaling = baseline['scaling'].get(stage), result['scaling'].get(stage)
+        if base_scaling is not None and scaling is not None and scaling > base_scaling + scaling_margin:
+            regressions.append(f"{stage} scaling: n^{scaling:.2f} vs baseline n^{base_scaling:.2f}")
+    return regressions
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="benchmark the text stages on synthetic scripts and TextGrids")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help="script sizes in lines")
+    parser.add_argument('--onomato-density', type=float, default=0.2)
+    parser.add_argument('--insert-rate', type=float, default=0.02)
+    parser.add_argument('--delete-rate', type=float, default=0.02)
+    parser.add_argument('--tg-insert-rate', type=float, default=0.0)
+    parser.add_argument('--tg-delete-rate', type=float, default=0.02)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=5, help="interleaved rounds over all stages and sizes, compared by their median")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=str(BASELINE), help="baseline json to compare against, '' to skip the comparison")
+    parser.add_argument('--save-baseline', default=None, help="write the result as a baseline json")
+    parser.add_argument('--threshold', type=float, default=0.35, help="allowed slowdown, 0.35 = 35%%, see the noise floor above")
+    args = parser.parse_args()
+    result = run_benchmark(sizes=args.sizes, onomato_density=args.onomato_density, insert_rate=args.insert_rate,
+                           delete_rate=args.delete_rate, tg_insert_rate=args.tg_insert_rate, tg_delete_rate=args.tg_delete_rate, repeat=args.repeat, rounds=args.rounds, seed=args.seed)
+    for stage in STAGES:
+        times = '  '.join(f"{size}: {seconds * 1000:9.2f} ms" for size, seconds in result['timings'][stage].items())
+        print(f"{stage:18} {times}  scaling n^{result['scaling'][stage]:.2f}")
+    # read the baseline before saving, so refreshing the default baseline still compares against the previous one
+    baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8')) if args.baseline else None
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(result, indent=1), encoding='utf-8')
+    if baseline is not None:
+        regressions = compare(result, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
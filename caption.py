@@ -6,6 +6,7 @@ from transformers import pipeline
 from datasets import Dataset
 from torch.utils.data import DataLoader
 import logging
+from segments import Segment, offset_chunks, read_segments, save, segments_path
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -16,10 +17,17 @@ def collate_fn(batch):
     pass
 
 class ASRInference:
-    def __init__(self, model_id: str = None, model_path: str = None, batch_size: int = 16):
+    """
+    return_timestamps: None for segment level text only, True for chunk level or 'word' for word level timestamps (offset to the whole audio),
+    the timestamped chunks are what JapaneseTextAligner.align_asr aligns scripts to
+    pcm_cache: audio_cache.PCMCache to slice segments from the memory-mapped decoded audio, None loads the whole file with librosa
+    """
+    def __init__(self, model_id: str = None, model_path: str = None, batch_size: int = 16, return_timestamps: bool | str = None, pcm_cache=None):
         self.model_id = model_id
         self.model_path = model_path
         self.batch_size = batch_size
+        self.return_timestamps = return_timestamps
+        self.pcm_cache = pcm_cache
         self.pipe, self.generate_kwargs = self._load_model()
         
     def _load_model(self):
@@ -39,31 +47,62 @@ class ASRInference:
         }
         return pipe, generate_kwargs
     
+    @staticmethod
+    def _has_segments(vad_segments: Path):
+        return vad_segments.exists() or segments_path(vad_segments).exists()
+
     def _data_generator(self, audio: str|Path, vad_segments: str|Path):
-        # extract audio segments from vad segments file, each segment contains 'start_time' and 'end_time', then yield the segment.
+        # extract audio segments from vad segments (the '.seg.jsonl' manifest, or its '.txt' view), each segment contains 'start_time' and 'end_time', then yield the segment.
         audio, vad_segments = Path(audio), Path(vad_segments)
-        if not audio.exists() or not vad_segments.exists():
+        if not audio.exists() or not self._has_segments(vad_segments):
             return
-        audio, _ = librosa.load(audio, sr=SAMPLE_RATE)
-        vad_segments = vad_segments.read_text(encoding='utf-8').splitlines()
-        for segment in vad_segments:
-            start_time, end_time = map(float, segment.split('\t')[:2])
+        if self.pcm_cache is None:
+            audio, _ = librosa.load(audio, sr=SAMPLE_RATE)
+        else:
+            audio = self.pcm_cache.load(audio)
+        for segment in read_segments(vad_segments):
+            start_time, end_time = segment.start, segment.end
             start_slice, end_slice = int(start_time*SAMPLE_RATE), int(end_time*SAMPLE_RATE)
             if end_slice > len(audio):
                 end_slice = len(audio)
             # "When passing a dictionary to AutomaticSpeechRecognitionPipeline, the dict needs to contain a "raw" key containing the numpy array representing the audio and a "sampling_rate" key, containing the sampling_rate associated with that array" 
-            yield {'raw': audio[start_slice:end_slice], 'sampling_rate': SAMPLE_RATE, 'start_time':start_time, 'end_time':end_time}
+            yield {'raw': np.asarray(audio[start_slice:end_slice]), 'sampling_rate': SAMPLE_RATE, 'start_time':start_time, 'end_time':end_time}
     def inference(self, audio: str|Path, vad_segments: str|Path):
         audio, vad_segments = Path(audio), Path(vad_segments)
-        if not audio.exists() or not vad_segments.exists():
+        if not audio.exists() or not self._has_segments(vad_segments):
             return
         raw_dataset = Dataset.from_generator(self._data_generator, gen_kwargs={"audio": audio, "vad_segments": vad_segments})
         dataset = raw_dataset.select_columns(['raw', 'sampling_rate'])
         dataset = dataset.with_format("numpy")
         dataloader = DataLoader(dataset, batch_size=self.batch_size, shuffle=False, num_workers=0, collate_fn=lambda x: x)
         texts = []
+        pipe_kwargs = {} if self.return_timestamps is None else {"return_timestamps": self.return_timestamps}
         for batch in dataloader:
-            result = self.pipe(batch, generate_kwargs=self.generate_kwargs)
+            result = self.pipe(batch, generate_kwargs=self.generate_kwargs, **pipe_kwargs)
             texts.extend(result)
         final_result = [{"start_time": raw_dataset[i]['start_time'], "end_time": raw_dataset[i]['end_time'], **item} for i, item in enumerate(texts) if i < len(raw_dataset)]
-        return final_result
\ No newline at end of file
+        for item in final_result:
+            if 'chunks' in item:
+                item['chunks'] = offset_chunks(item['chunks'], item['start_time'], item['end_time'])
+        return final_result
+
+    def transcribe(self, audio: str|Path, vad_segments: str|Path, output: str|Path = None):
+        """
+        Transcribe the vad segments of audio, write the hypotheses as segments ('.asr.seg.jsonl') and their text view (default: audio with '.asr.txt' extension)
+        with return_timestamps there is one segment per timestamped chunk, line_num is the index of its vad segment
+        Return the segments, None if there is nothing to transcribe
+        """
+        audio = Path(audio)
+        output = audio.with_suffix('.asr.txt') if output is None else Path(output)
+        result = self.inference(audio, vad_segments)
+        if result is None:
+            return
+        segments = []
+        for i, item in enumerate(result, 1):
+            if item.get('chunks'):
+                segments.extend(Segment(float(chunk['timestamp'][0]), float(chunk['timestamp'][1]), chunk['text'].strip(), i, source=audio.name)
+                                for chunk in item['chunks'])
+            else:
+                segments.append(Segment(float(item['start_time']), float(item['end_time']), item['text'].strip(), i, source=audio.name))
+        save(segments, output, 'aligned')
+        return segments
@@ -0,0 +1,245 @@
+import time
+import zlib
+import sqlite3
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+INVALID_CHARS = '<>:"/\\|?*'
+RAW = 'raw'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    content_hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS works (
+    rj_code TEXT PRIMARY KEY,
+    complete INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scripts (
+    rj_code TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    variant TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content_hash TEXT NOT NULL REFERENCES blobs (content_hash),
+    source_url TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (rj_code, idx, variant)
+);
+CREATE INDEX IF NOT EXISTS scripts_hash ON scripts (content_hash);
+CREATE TABLE IF NOT EXISTS signatures (
+    content_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    PRIMARY KEY (content_hash, params)
+);
+CREATE TABLE IF NOT EXISTS duplicates (
+    rj_code TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    variant TEXT NOT NULL,
+    canonical_rj_code TEXT NOT NULL,
+    canonical_idx INTEGER NOT NULL,
+    similarity REAL NOT NULL,
+    PRIMARY KEY (rj_code, idx, variant)
+);
+"""
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def sanitize_title(title: str) -> str:
+    return "".join(c for c in title if c not in INVALID_CHARS)
+
+@dataclass
+class ScriptRecord:
+    """One script text of a work, variant is 'raw' for crawled text, derived texts (e.g. 'filtered') are stored next to it"""
+    rj_code: str
+    idx: int
+    title: str
+    text: str
+    content_hash: str
+    variant: str = RAW
+    source_url: Optional[str] = None
+
+    @property
+    def file_name(self) -> str:
+        """file name of the script in the legacy folder layout"""
+        return f"{self.idx} {sanitize_title(self.title)}.txt"
+
+class CorpusStore:
+    """
+    Single sqlite corpus of crawled scripts keyed by (RJ code, script index, variant).
+    Texts are zlib compressed and stored once per content hash, so identical scripts across tracks and works share storage.
+    """
+    def __init__(self, path: str | Path = 'corpus.sqlite3'):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _put_blob(self, text: str) -> str:
+        text_hash = content_hash(text)
+        self.conn.execute("INSERT OR IGNORE INTO blobs (content_hash, data) VALUES (?, ?)", (text_hash, zlib.compress(text.encode('utf-8'), 9)))
+        return text_hash
+
+    def put(self, rj_code: str, idx: int, title: str, text: str, variant: str = RAW, source_url: str = None) -> str:
+        """
+        Store a script text, return its content hash
+        """
+        with self.conn:
+            text_hash = self._put_blob(text)
+            self.conn.execute(
+                "INSERT INTO works (rj_code, complete, updated_at) VALUES (?, 0, ?) ON CONFLICT(rj_code) DO NOTHING",
+                (rj_code, time.time()),
+            )
+            self.conn.execute(
+                "INSERT INTO scripts (rj_code, idx, variant, title, content_hash, source_url, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(rj_code, idx, variant) DO UPDATE SET title = excluded.title, content_hash = excluded.content_hash, "
+                "source_url = COALESCE(excluded.source_url, scripts.source_url), updated_at = excluded.updated_at",
+                (rj_code, idx, variant, title, text_hash, source_url, time.time()),
+            )
+        return text_hash
+
+    def has(self, rj_code: str, idx: int, variant: str = RAW) -> bool:
+        row = self.conn.execute("SELECT 1 FROM scripts WHERE rj_code = ? AND idx = ? AND variant = ?", (rj_code, idx, variant)).fetchone()
+        return row is not None
+
+    def mark_complete(self, rj_code: str, complete: bool = True):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO works (rj_code, complete, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(rj_code) DO UPDATE SET complete = excluded.complete, updated_at = excluded.updated_at",
+                (rj_code, int(complete), time.time()),
+            )
+
+    def is_complete(self, rj_code: str) -> bool:
+        row = self.conn.execute("SELECT complete FROM works WHERE rj_code = ?", (rj_code,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def delete_work(self, rj_code: str):
+        """
+        Remove a work and its scripts, blobs no longer referenced by any script are dropped
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM scripts WHERE rj_code = ?", (rj_code,))
+            self.conn.execute("DELETE FROM works WHERE rj_code = ?", (rj_code,))
+            self.conn.execute("DELETE FROM blobs WHERE content_hash NOT IN (SELECT content_hash FROM scripts)")
+
+    def get(self, rj_code: str, idx: int, variant: str = RAW) -> Optional[ScriptRecord]:
+        return next(self.iter_scripts(rj_code, variant, complete_only=False, idx=idx), None)
+
+    def iter_scripts(self, rj_code: str = None, variant: str = RAW, complete_only: bool = True, idx: int = None) -> Iterator[ScriptRecord]:
+        """
+        Stream scripts ordered by RJ code and index, only works with every script crawled unless complete_only is False
+        """
+        query = ("SELECT s.rj_code, s.idx, s.title, b.data, s.content_hash, s.variant, s.source_url FROM scripts s "
+                 "JOIN blobs b ON b.content_hash = s.content_hash JOIN works w ON w.rj_code = s.rj_code WHERE s.variant = ?")
+        params = [variant]
+        if complete_only:
+            query += " AND w.complete = 1"
+        if rj_code is not None:
+            query += " AND s.rj_code = ?"
+            params.append(rj_code)
+        if idx is not None:
+            query += " AND s.idx = ?"
+            params.append(idx)
+        query += " ORDER BY s.rj_code, s.idx"
+        # a separate cursor keeps the stream independent of writes made while iterating
+        for rj, i, title, data, text_hash, var, url in self.conn.cursor().execute(query, params):
+            yield ScriptRecord(rj, i, title, zlib.decompress(data).decode('utf-8'), text_hash, var, url)
+
+    def find(self, text_hash: str) -> list[tuple[str, int]]:
+        """
+        (rj_code, idx) of the scripts having text_hash in any variant, e.g. to find which script a file on disk holds
+        """
+        rows = self.conn.execute("SELECT DISTINCT rj_code, idx FROM scripts WHERE content_hash = ? ORDER BY rj_code, idx", (text_hash,))
+        return [tuple(row) for row in rows]
+
+    def rj_codes(self, complete_only: bool = True) -> list[str]:
+        query = "SELECT rj_code FROM works" + (" WHERE complete = 1" if complete_only else "") + " ORDER BY rj_code"
+        return [row[0] for row in self.conn.execute(query)]
+
+    def export_folder(self, out_dir: str | Path, variant: str = RAW, rj_codes=None) -> int:
+        """
+        Write scripts to the legacy layout out_dir/<RJ code>/<index> <title>.txt, return the number of files written
+        """
+        out_dir = Path(out_dir)
+        count = 0
+        for rj_code in (self.rj_codes() if rj_codes is None else rj_codes):
+            for record in self.iter_scripts(rj_code, variant):
+                work_dir = out_dir / record.rj_code
+                work_dir.mkdir(parents=True, exist_ok=True)
+                (work_dir / record.file_name).write_text(record.text, encoding='utf-8')
+                count += 1
+        return count
+
+    def import_folder(self, folder: str | Path) -> int:
+        """
+        Ingest works in the legacy layout (folder/<RJ code>/<index> <title>.txt), return the number of scripts stored
+        """
+        count = 0
+        for work_dir in sorted(Path(folder).glob('RJ*')):
+            if not work_dir.is_dir():
+                continue
+            for script in work_dir.glob('*.txt'):
+                idx, _, title = script.stem.partition(' ')
+                if not idx.isdigit():
+                    continue
+                self.put(work_dir.name, int(idx), title, script.read_text(encoding='utf-8'))
+                count += 1
+            self.mark_complete(work_dir.name)
+        return count
+
+    def signatures(self, params: str) -> dict:
+        """
+        cached MinHash signatures (see dedup.py) by content hash
+        """
+        import numpy as np
+        rows = self.conn.execute("SELECT content_hash, signature FROM signatures WHERE params = ?", (params,))
+        return {text_hash: np.frombuffer(signature, dtype=np.uint64) for text_hash, signature in rows}
+
+    def put_signatures(self, params: str, signatures: dict):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO signatures (content_hash, params, signature) VALUES (?, ?, ?)",
+                ((text_hash, params, signature.tobytes()) for text_hash, signature in signatures.items()),
+            )
+
+    def set_duplicates(self, variant: str, duplicates):
+        """
+        replace the duplicate records of variant with rows of (rj_code, idx, canonical_rj_code, canonical_idx, similarity)
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM duplicates WHERE variant = ?", (variant,))
+            self.conn.executemany(
+                "INSERT INTO duplicates (rj_code, idx, variant, canonical_rj_code, canonical_idx, similarity) VALUES (?, ?, ?, ?, ?, ?)",
+                ((rj_code, idx, variant, canonical_rj_code, canonical_idx, similarity)
+                 for rj_code, idx, canonical_rj_code, canonical_idx, similarity in duplicates),
+            )
+
+    def canonical(self, rj_code: str, idx: int, variant: str = RAW) -> Optional[tuple[str, int, float]]:
+        """
+        (canonical RJ code, canonical index, similarity) when the script duplicates an earlier one, so its processed results can be reused, else None
+        """
+        return self.conn.execute(
+            "SELECT canonical_rj_code, canonical_idx, similarity FROM duplicates WHERE rj_code = ? AND idx = ? AND variant = ?",
+            (rj_code, idx, variant),
+        ).fetchone()
+
+    def stats(self) -> dict:
+        scripts, unique, stored = self.conn.execute(
+            "SELECT (SELECT COUNT(*) FROM scripts), (SELECT COUNT(*) FROM blobs), (SELECT COALESCE(SUM(LENGTH(data)), 0) FROM blobs)"
+        ).fetchone()
+        return {'works': len(self.rj_codes(complete_only=False)), 'scripts': scripts, 'unique_texts': unique, 'stored_bytes': stored}
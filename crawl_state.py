@@ -0,0 +1,126 @@
+import time
+import sqlite3
+from pathlib import Path
+
+# status of list pages, works and scripts
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+NO_JAPANESE = 'no_japanese'
+FINAL_STATUSES = (DONE, NO_JAPANESE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS list_pages (
+    page INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS works (
+    details_href TEXT PRIMARY KEY,
+    rj_code TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS scripts (
+    script_href TEXT PRIMARY KEY,
+    details_href TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    content_hash TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS works_status ON works (status);
+CREATE INDEX IF NOT EXISTS scripts_work ON scripts (details_href);
+"""
+
+class CrawlLedger:
+    """
+    Local sqlite record of crawled list pages, works (keyed by their details link) and scripts, with status, attempts and content hash.
+    Every mark is committed immediately, so a crashed run resumes from the last recorded item.
+    """
+    def __init__(self, path: str | Path = 'crawl_state.sqlite3'):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def list_page_done(self, page: int) -> bool:
+        row = self.conn.execute("SELECT status FROM list_pages WHERE page = ?", (page,)).fetchone()
+        return row is not None and row['status'] == DONE
+
+    def mark_list_page(self, page: int, status: str, error: str = None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO list_pages (page, status, updated_at, error) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(page) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at, error = excluded.error",
+                (page, status, time.time(), error),
+            )
+
+    def work(self, details_href: str):
+        return self.conn.execute("SELECT * FROM works WHERE details_href = ?", (details_href,)).fetchone()
+
+    def work_skippable(self, details_href: str, max_attempts: int) -> bool:
+        """
+        True when the work is complete (or has no japanese script), or failed max_attempts times, so it needs no navigation at all
+        """
+        row = self.work(details_href)
+        if row is None:
+            return False
+        return row['status'] in FINAL_STATUSES or (row['status'] == FAILED and row['attempts'] >= max_attempts)
+
+    def mark_work(self, details_href: str, status: str, rj_code: str = None, error: str = None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO works (details_href, rj_code, status, attempts, updated_at, error) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(details_href) DO UPDATE SET rj_code = COALESCE(excluded.rj_code, works.rj_code), status = excluded.status, "
+                "attempts = works.attempts + excluded.attempts, updated_at = excluded.updated_at, error = excluded.error",
+                (details_href, rj_code, status, int(status == FAILED), time.time(), error),
+            )
+
+    def retry_works(self, max_attempts: int) -> list[str]:
+        """
+        works left pending by a crashed run or failed fewer than max_attempts times
+        """
+        rows = self.conn.execute(
+            "SELECT details_href FROM works WHERE status = ? OR (status = ? AND attempts < ?) ORDER BY updated_at",
+            (PENDING, FAILED, max_attempts),
+        )
+        return [row['details_href'] for row in rows]
+
+    def script(self, script_href: str):
+        return self.conn.execute("SELECT * FROM scripts WHERE script_href = ?", (script_href,)).fetchone()
+
+    def mark_script(self, script_href: str, details_href: str, idx: int, title: str, status: str, content_hash: str = None, error: str = None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO scripts (script_href, details_href, idx, title, status, content_hash, attempts, updated_at, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(script_href) DO UPDATE SET idx = excluded.idx, title = excluded.title, status = excluded.status, "
+                "content_hash = COALESCE(excluded.content_hash, scripts.content_hash), attempts = scripts.attempts + excluded.attempts, "
+                "updated_at = excluded.updated_at, error = excluded.error",
+                (script_href, details_href, idx, title, status, content_hash, int(status == FAILED), time.time(), error),
+            )
+
+    def summary(self) -> dict:
+        """
+        item counts per status, e.g. {'works': {'done': 10, 'failed': 1}, ...}
+        """
+        return {
+            table: dict(self.conn.execute(f"SELECT status, COUNT(*) FROM {table} GROUP BY status").fetchall())
+            for table in ('list_pages', 'works', 'scripts')
+        }
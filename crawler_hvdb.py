@@ -1,113 +1,341 @@
-import os
 import re
-import time
-from playwright.sync_api import sync_playwright
+import asyncio
 import logging
 from pathlib import Path
+from contextlib import asynccontextmanager, AsyncExitStack
+from playwright.async_api import async_playwright
+from crawl_state import CrawlLedger, PENDING, DONE, FAILED, NO_JAPANESE
+from corpus import CorpusStore, content_hash
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
+# httpx logs every request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
 # Base URL
 base_url = "https://hvdb.me"
+TIMEOUT = 30000
+FETCH_MODES = ('browser', 'http', 'auto')
+# a rendered script page has one of these rows, english only scripts have just the engScript row
+SCRIPT_ROWS = ".row.japScript, .row.bothScript, .row.engScript"
+# returned by the script page parsers for a page whose script has no japanese text, None means the page content is missing
+NO_JAPANESE_SCRIPT = object()
 
-def scrape_rj_codes():
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        context = browser.new_context()
-        # Start from page 2 based on the image
-        current_page = 93
-        end_page = 93
-        while current_page <= end_page:
-            url = f"{base_url}/?page={current_page}&sort=scriptsort&pageSize=50"
-            try:
-                # 1. Navigate to the RJ code list page
-                logging.info(f"Scraping page list {current_page}...")
-                page = context.new_page()
-                page.goto(url, timeout=30000)
-                page.wait_for_load_state("networkidle")
-                details_links = page.query_selector_all("a[href^='/Dashboard/Details/']")
-                unique_details_links = [link for link in details_links]
-
-                for link in unique_details_links:
-                    try:
-                        # 2. Navigate to the RJ ocde Details page
-                        href = link.get_attribute("href")
-                        details_page = context.new_page()
-                        details_page.goto(f"{base_url}{href}", timeout=30000)
-                        details_page.wait_for_selector("a:has-text('View Scripts')")
-                        
-                        h2_element = details_page.query_selector('h2')
-                        h2_text = h2_element.text_content() if h2_element else ""
-                        match = re.search(r'RJ\d+', h2_text)
-                        rj_code = match.group(0) if match else "NA"
-                        logging.info(f"RJ Code: {rj_code}")
-                        rj_code_dir = Path(f"{rj_code}")
-                        if rj_code_dir.exists():
-                            logging.info(f"Folder {rj_code_dir} already exists, skipping...")
-                            details_page.close()
-                            continue
-                        rj_code_dir.mkdir(parents=True, exist_ok=True)
-
-                        view_scripts_button = details_page.query_selector("a:has-text('View Scripts')")
-                        # view_scripts_button = page.query_selector('a.btn.btn-default[href^="/Dashboard/ScriptList/"]')
-
-                        scripts_link = view_scripts_button.get_attribute("href")
-                        # 3. Navigate to the scripts list page
-                        scripts_list_page = context.new_page()
-                        scripts_list_page.goto(f"{base_url}{scripts_link}")
-                        scripts_list_page.wait_for_selector("a[href^='/Dashboard/Script/']")
-                        # Extract the script detail links
-                        script_links = scripts_list_page.query_selector_all("a[href^='/Dashboard/Script/']")
-                        # Create a folder for the track title
-                        unique_scripts_links = [script_link for script_link in script_links]
-
-                        for i,script_link in enumerate(unique_scripts_links, 1):
-                            # 4. Navigate to the script detail page
-                            try:
-                                script_href = script_link.get_attribute("href")
-                                script_title = script_link.text_content()
-                                invalid_chars = '<>:"/\\|?*'
-                                script_title = str(i) + " " + "".join(c for c in script_title if c not in invalid_chars)
-                                script_page = context.new_page()
-                                script_page.goto(f"{base_url}{script_href}", timeout=30000)
-                                
-                                if script_page.is_visible(".row.japScript", timeout=30000):
-                                    # # Extract the HTML content of the script detail page
-                                    script_box = script_page.query_selector(".row.japScript p")
-                                    script_text = script_box.text_content() if script_box else ""
-                                elif script_page.is_visible(".row.bothScript", timeout=30000):
-                                    script_box = script_page.query_selector(".row.bothScript > div:first-child p.double-box")
-                                    script_text = script_box.text_content() if script_box else ""
-                                else:
-                                    import shutil
-                                    shutil.rmtree(rj_code_dir)
-                                    logging.info(f"Script Title: {script_title} - No script japanese content found, removing folder {rj_code_dir}")
-                                    break
-                                # Save the script content to a file
-                                script_file = rj_code_dir / f"{script_title}.txt"
-                                with open(script_file, "w", encoding="utf-8") as f:
-                                    f.write(script_text)
-                                # time.sleep(1)
-                                script_page.close()
-                            except Exception as e:
-                                logging.error(f"Error occurred while fetching script for script {script_title}: {e}")
-                                script_page.close()
-                        scripts_list_page.close()
-                        details_page.close()
-                    except Exception as e:
-                        logging.error(f"Error occurred while fetching rj detail link or its script lists for {href}: {e}")
-                        scripts_list_page.close()
-                        details_page.close()
-
-                current_page += 1
-                time.sleep(1)
-                page.close()
-            except Exception as e:
-                logging.error(f"Error occurred while fetching page list {current_page}: {e}")
-                current_page += 1
-                continue
-        # Close the browser
-        browser.close()
+def parse_list_page(tree):
+    """
+    plain html parsers, each returns None when the expected elements are missing (e.g. the page needs javascript)
+    """
+    links = [node.attributes.get('href') for node in tree.css("a[href^='/Dashboard/Details/']")]
+    return links or None
+
+def parse_details_page(tree):
+    view_scripts = next((node for node in tree.css('a') if 'View Scripts' in node.text()), None)
+    if view_scripts is None:
+        return None
+    h2_element = tree.css_first('h2')
+    return (h2_element.text() if h2_element else ""), view_scripts.attributes.get('href')
+
+def parse_script_list_page(tree):
+    links = [(node.attributes.get('href'), node.text()) for node in tree.css("a[href^='/Dashboard/Script/']")]
+    return links or None
+
+def parse_script_page(tree):
+    if tree.css_first(".row.japScript"):
+        script_box = tree.css_first(".row.japScript p")
+    elif tree.css_first(".row.bothScript"):
+        script_box = tree.css_first(".row.bothScript > div:first-child p.double-box")
+    elif tree.css_first(SCRIPT_ROWS):
+        return NO_JAPANESE_SCRIPT
+    else:
+        return None
+    return script_box.text() if script_box else ""
+
+class HttpFetcher:
+    """
+    Pooled keep-alive http client for pages that don't need javascript
+    """
+    def __init__(self, max_connections: int = 16):
+        import httpx
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=TIMEOUT / 1000,
+            follow_redirects=True,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    async def tree(self, url: str):
+        from selectolax.lexbor import LexborHTMLParser
+        response = await self.client.get(url)
+        response.raise_for_status()
+        return LexborHTMLParser(response.text)
+
+class PagePool:
+    """
+    Fixed set of reusable pages, a page is borrowed for a single navigation and returned afterwards, all pages are closed with the pool.
+    The browser is launched on first use, so an http-first crawl that never needs javascript never starts chromium.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.pages = []
+        self.queue = asyncio.Queue()
+        self.lock = asyncio.Lock()
+        self.playwright = None
+        self.browser = None
+
+    async def _start(self):
+        async with self.lock:
+            if self.browser is not None:
+                return
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch()
+            context = await self.browser.new_context()
+            for _ in range(self.size):
+                page = await context.new_page()
+                self.pages.append(page)
+                self.queue.put_nowait(page)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        for page in self.pages:
+            await page.close()
+        if self.browser is not None:
+            # Close the browser
+            await self.browser.close()
+            await self.playwright.stop()
+
+    @asynccontextmanager
+    async def page(self):
+        if self.browser is None:
+            await self._start()
+        page = await self.queue.get()
+        try:
+            yield page
+        finally:
+            self.queue.put_nowait(page)
+
+class HvdbCrawler:
+    """
+    Concurrent hvdb script crawler. Pages never stay borrowed while waiting for child links, so the pool can't deadlock,
+    and every stage (list pages, details pages, script pages) has its own concurrency limit.
+    With an http fetcher, pages are fetched and parsed as plain html, the browser pool (if any) is only used when the html lacks the expected elements.
+    Scripts are written into the corpus store, a work is marked complete there once every script is saved.
+    Progress is recorded in the crawl ledger: complete works are skipped straight from the list page, scripts of an unfinished work are only fetched again if they aren't done.
+    Works already present as legacy folders in out_dir are skipped too.
+    With refresh, the scripts of complete works are fetched again and compared to the content hash in the ledger, only changed scripts are stored.
+    """
+    def __init__(self, pool: PagePool | None, ledger: CrawlLedger, corpus: CorpusStore, base_url: str = base_url, out_dir: str | Path = '.',
+                 list_concurrency: int = 2, details_concurrency: int = 4, script_concurrency: int = 8, http: HttpFetcher | None = None,
+                 max_attempts: int = 3, refresh: bool = False):
+        if pool is None and http is None:
+            raise ValueError("either a page pool or an http fetcher is required")
+        self.pool = pool
+        self.http = http
+        self.ledger = ledger
+        self.corpus = corpus
+        self.max_attempts = max_attempts
+        self.refresh = refresh
+        # a work can be listed on several list pages, and retried before them
+        self.seen = set()
+        self.changed = 0
+        self.base_url = base_url
+        self.out_dir = Path(out_dir)
+        self.list_limit = asyncio.Semaphore(list_concurrency)
+        self.details_limit = asyncio.Semaphore(details_concurrency)
+        self.script_limit = asyncio.Semaphore(script_concurrency)
+
+    async def _fetch(self, url: str, parser, browser_fetch):
+        """
+        parse url with the http fast path, fall back to browser_fetch(page, url) when the html doesn't contain the data
+        """
+        if self.http is not None:
+            result = parser(await self.http.tree(url))
+            if result is not None:
+                return result
+            if self.pool is None:
+                raise ValueError(f"{url} needs javascript, which the http fetch mode can't run")
+            logging.debug(f"{url} needs javascript, falling back to browser")
+        async with self.pool.page() as page:
+            return await browser_fetch(page, url)
+
+    @staticmethod
+    async def _browser_list_page(page, url: str):
+        await page.goto(url, timeout=TIMEOUT)
+        await page.wait_for_load_state("networkidle")
+        details_links = await page.query_selector_all("a[href^='/Dashboard/Details/']")
+        return [await link.get_attribute("href") for link in details_links]
+
+    @staticmethod
+    async def _browser_details_page(page, url: str):
+        await page.goto(url, timeout=TIMEOUT)
+        await page.wait_for_selector("a:has-text('View Scripts')", timeout=TIMEOUT)
+        h2_element = await page.query_selector('h2')
+        h2_text = await h2_element.text_content() if h2_element else ""
+        view_scripts_button = await page.query_selector("a:has-text('View Scripts')")
+        return h2_text, await view_scripts_button.get_attribute("href")
+
+    @staticmethod
+    async def _browser_script_list_page(page, url: str):
+        await page.goto(url, timeout=TIMEOUT)
+        await page.wait_for_selector("a[href^='/Dashboard/Script/']", timeout=TIMEOUT)
+        script_links = await page.query_selector_all("a[href^='/Dashboard/Script/']")
+        return [(await link.get_attribute("href"), await link.text_content()) for link in script_links]
+
+    @staticmethod
+    async def _browser_script_page(page, url: str):
+        await page.goto(url, timeout=TIMEOUT)
+        await page.wait_for_selector(SCRIPT_ROWS, timeout=TIMEOUT)
+        if await page.is_visible(".row.japScript"):
+            script_box = await page.query_selector(".row.japScript p")
+        elif await page.is_visible(".row.bothScript"):
+            script_box = await page.query_selector(".row.bothScript > div:first-child p.double-box")
+        else:
+            return NO_JAPANESE_SCRIPT
+        return await script_box.text_content() if script_box else ""
+
+    async def scrape_list_page(self, page_num: int):
+        url = f"{self.base_url}/?page={page_num}&sort=scriptsort&pageSize=50"
+        try:
+            # 1. Navigate to the RJ code list page
+            async with self.list_limit:
+                logging.info(f"Scraping page list {page_num}...")
+                hrefs = await self._fetch(url, parse_list_page, self._browser_list_page) or []
+        except Exception as e:
+            logging.error(f"Error occurred while fetching page list {page_num}: {e}")
+            self.ledger.mark_list_page(page_num, FAILED, str(e))
+            return
+        await asyncio.gather(*(self.scrape_work(href) for href in dict.fromkeys(hrefs)))
+        self.ledger.mark_list_page(page_num, DONE)
+
+    async def scrape_work(self, href: str):
+        if href in self.seen:
+            return
+        self.seen.add(href)
+        row = self.ledger.work(href)
+        recheck = self.refresh and row is not None and row['status'] == DONE
+        if not recheck and self.ledger.work_skippable(href, self.max_attempts):
+            logging.debug(f"{href} already crawled, skipping...")
+            return
+        self.ledger.mark_work(href, PENDING)
+        try:
+            async with self.details_limit:
+                # 2. Navigate to the RJ code Details page
+                details = await self._fetch(f"{self.base_url}{href}", parse_details_page, self._browser_details_page)
+                if details is None:
+                    raise ValueError("'View Scripts' link not found")
+                h2_text, scripts_link = details
+                match = re.search(r'RJ\d+', h2_text)
+                rj_code = match.group(0) if match else "NA"
+                logging.info(f"RJ Code: {rj_code}")
+                rj_code_dir = self.out_dir / rj_code
+                if (self.corpus.is_complete(rj_code) and not recheck) or rj_code_dir.exists():
+                    logging.info(f"{rj_code} already crawled, skipping...")
+                    self.ledger.mark_work(href, DONE, rj_code)
+                    return
+                # 3. Navigate to the scripts list page
+                scripts = await self._fetch(f"{self.base_url}{scripts_link}", parse_script_list_page, self._browser_script_list_page)
+                if scripts is None:
+                    raise ValueError("script links not found")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching rj detail link or its script lists for {href}: {e}")
+            self.ledger.mark_work(href, FAILED, error=str(e))
+            return
+        statuses = await asyncio.gather(*(self.scrape_script(script_href, i, title, rj_code, href) for i, (script_href, title) in enumerate(scripts, 1)))
+        # the work is only kept when every script has japanese content
+        if NO_JAPANESE in statuses:
+            logging.info(f"{rj_code}: No script japanese content found, skipping work")
+            self.corpus.delete_work(rj_code)
+            self.ledger.mark_work(href, NO_JAPANESE, rj_code)
+        elif FAILED in statuses:
+            self.ledger.mark_work(href, FAILED, rj_code, f"{statuses.count(FAILED)} scripts failed")
+        else:
+            self.corpus.mark_complete(rj_code)
+            self.ledger.mark_work(href, DONE, rj_code)
+
+    async def scrape_script(self, script_href: str, idx: int, script_title: str, rj_code: str, details_href: str):
+        """
+        4. Navigate to the script detail page and save its japanese text to the corpus, return the script status (done, no_japanese or failed)
+        """
+        row = self.ledger.script(script_href)
+        done = row is not None and row['status'] == DONE and self.corpus.has(rj_code, idx)
+        if done and not self.refresh:
+            return DONE
+        try:
+            async with self.script_limit:
+                script_text = await self._fetch(f"{self.base_url}{script_href}", parse_script_page, self._browser_script_page)
+        except Exception as e:
+            logging.error(f"Error occurred while fetching script for script {script_title}: {e}")
+            self.ledger.mark_script(script_href, details_href, idx, script_title, FAILED, error=str(e))
+            return FAILED
+        if script_text is NO_JAPANESE_SCRIPT:
+            logging.info(f"Script Title: {script_title} - No script japanese content found")
+            self.ledger.mark_script(script_href, details_href, idx, script_title, NO_JAPANESE)
+            return NO_JAPANESE
+        if done and content_hash(script_text) == row['content_hash']:
+            self.ledger.mark_script(script_href, details_href, idx, script_title, DONE)
+            return DONE
+        if done:
+            logging.info(f"{rj_code} script {idx} changed upstream")
+            self.changed += 1
+        # Save the script content to the corpus
+        text_hash = self.corpus.put(rj_code, idx, script_title, script_text, source_url=script_href)
+        self.ledger.mark_script(script_href, details_href, idx, script_title, DONE, text_hash)
+        return DONE
+
+async def scrape_rj_codes_async(start_page: int, end_page: int, base_url: str = base_url, out_dir: str | Path = '.', pool_size: int = 8,
+                                list_concurrency: int = 2, details_concurrency: int = 4, script_concurrency: int = 8, fetch_mode: str = 'auto',
+                                state_path: str | Path = None, refresh: bool = False, max_attempts: int = 3, corpus_path: str | Path = None, export: bool = False):
+    """
+    Scrape scripts of every work listed on list pages start_page..end_page (inclusive) into the corpus store (default out_dir/corpus.sqlite3),
+    with export set, complete works are also written to the legacy layout out_dir/<RJ code>/<index> <title>.txt
+    fetch_mode: 'browser' renders every page in headless chromium, 'http' only fetches plain html, 'auto' uses http and falls back to the browser for pages needing javascript
+    The crawl ledger (default out_dir/crawl_state.sqlite3) makes runs resumable: works left unfinished or failed (fewer than max_attempts times) are retried first,
+    list pages already done are skipped unless refresh is set, refresh also fetches the scripts of complete works again and stores those whose content hash changed.
+    """
+    if fetch_mode not in FETCH_MODES:
+        raise ValueError(f"Unknown fetch mode {fetch_mode}, choose from {list(FETCH_MODES)}")
+    async with AsyncExitStack() as stack:
+        http = await stack.enter_async_context(HttpFetcher(pool_size * 2)) if fetch_mode != 'browser' else None
+        pool = await stack.enter_async_context(PagePool(pool_size)) if fetch_mode != 'http' else None
+        state_path = Path(out_dir) / 'crawl_state.sqlite3' if state_path is None else state_path
+        Path(state_path).parent.mkdir(parents=True, exist_ok=True)
+        ledger = stack.enter_context(CrawlLedger(state_path))
+        corpus = stack.enter_context(CorpusStore(Path(out_dir) / 'corpus.sqlite3' if corpus_path is None else corpus_path))
+        crawler = HvdbCrawler(pool, ledger, corpus, base_url, out_dir, list_concurrency, details_concurrency, script_concurrency, http, max_attempts, refresh)
+        await asyncio.gather(*(crawler.scrape_work(href) for href in ledger.retry_works(max_attempts)))
+        pages = [n for n in range(start_page, end_page + 1) if refresh or not ledger.list_page_done(n)]
+        await asyncio.gather(*(crawler.scrape_list_page(n) for n in pages))
+        logging.info(f"Crawl state: {ledger.summary()}, corpus: {corpus.stats()}" + (f", {crawler.changed} scripts changed upstream" if refresh else ""))
+        if export:
+            exported = [rj_code for rj_code in corpus.rj_codes() if not (Path(out_dir) / rj_code).exists()]
+            logging.info(f"Exported {corpus.export_folder(out_dir, rj_codes=exported)} scripts to {out_dir}")
+
+def scrape_rj_codes(start_page: int, end_page: int, **kwargs):
+    asyncio.run(scrape_rj_codes_async(start_page, end_page, **kwargs))
 
 if __name__ == "__main__":
-    scrape_rj_codes()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="scrape hvdb scripts")
+    parser.add_argument('start_page', type=int)
+    parser.add_argument('end_page', type=int, nargs='?', default=None)
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--list-concurrency', type=int, default=2)
+    parser.add_argument('--details-concurrency', type=int, default=4)
+    parser.add_argument('--script-concurrency', type=int, default=8)
+    parser.add_argument('--fetch-mode', default='auto', choices=FETCH_MODES)
+    parser.add_argument('--state-path', default=None, help="crawl ledger, default <out-dir>/crawl_state.sqlite3")
+    parser.add_argument('--refresh', action='store_true', help="fetch list pages again to find new works, and the scripts of complete works to find changed ones")
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--corpus-path', default=None, help="corpus store, default <out-dir>/corpus.sqlite3")
+    parser.add_argument('--export', action='store_true', help="also write complete works as <out-dir>/<RJ code>/<index> <title>.txt")
+    args = parser.parse_args()
+    scrape_rj_codes(args.start_page, args.start_page if args.end_page is None else args.end_page, out_dir=args.out_dir, pool_size=args.pool_size,
+                    list_concurrency=args.list_concurrency, details_concurrency=args.details_concurrency, script_concurrency=args.script_concurrency, fetch_mode=args.fetch_mode,
+                    state_path=args.state_path, refresh=args.refresh, max_attempts=args.max_attempts,
+                    corpus_path=args.corpus_path, export=args.export)
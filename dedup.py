@@ -0,0 +1,173 @@
+import numpy as np
+import regex as re
+from collections import defaultdict
+from logging import getLogger, basicConfig, DEBUG
+
+from onomato import normalize_japanese_text
+
+basicConfig(level=DEBUG)
+logger = getLogger(__name__)
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def normalize_for_shingles(text: str) -> str:
+    """
+    normalize_japanese_text, then drop whitespace and punctuation so formatting edits don't change the shingles
+    """
+    text = normalize_japanese_text(text)
+    return re.sub(r'[\s\p{P}\p{S}]+', '', text)
+
+def shingles(text: str, k: int = 5) -> np.ndarray:
+    """
+    unique 32 bit hashes of the character k-grams of text, computed as a vectorized polynomial rolling hash,
+    empty for text shorter than k
+    """
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    powers = np.uint64(1000003) ** np.arange(k, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        hashes = (windows * powers).sum(axis=1, dtype=np.uint64)
+    return np.unique((hashes ^ (hashes >> np.uint64(32))) & MAX_HASH)
+
+class MinHasher:
+    """
+    MinHash signatures with num_perm universal hash functions (a * x + b) mod (2^61 - 1)
+    """
+    def __init__(self, num_perm: int = 128, k: int = 5, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.k = k
+        # a, b and the shingle hashes are below 2^32, so a * x + b can't overflow uint64
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str, chunk: int = 4096) -> np.ndarray:
+        values = shingles(normalize_for_shingles(text), self.k)
+        signature = np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        for start in range(0, len(values), chunk):
+            block = values[start:start + chunk, None]
+            np.minimum(signature, ((block * self.a + self.b) % MERSENNE_PRIME).min(axis=0), out=signature)
+        return signature
+
+def lsh_params(threshold: float, num_perm: int) -> tuple[int, int]:
+    """
+    (bands, rows) with bands * rows <= num_perm whose S-curve midpoint (1 / bands) ^ (1 / rows) is closest to threshold
+    """
+    candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1)]
+    return min(candidates, key=lambda p: abs((1 / p[0]) ** (1 / p[1]) - threshold))
+
+class LSHIndex:
+    """
+    Banded locality sensitive hashing over MinHash signatures, keys sharing any band bucket are candidate pairs
+    """
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.buckets = defaultdict(list)
+        self.signatures = {}
+
+    def add(self, key, signature: np.ndarray):
+        self.signatures[key] = signature
+        for band in range(self.bands):
+            self.buckets[band, signature[band * self.rows:(band + 1) * self.rows].tobytes()].append(key)
+
+    def candidate_pairs(self):
+        pairs = set()
+        for keys in self.buckets.values():
+            for i in range(1, len(keys)):
+                for j in range(i):
+                    pairs.add((keys[j], keys[i]))
+        return pairs
+
+    def similarity(self, key1, key2) -> float:
+        """estimated jaccard similarity"""
+        return float(np.mean(self.signatures[key1] == self.signatures[key2]))
+
+    def clusters(self, key=None):
+        """
+        groups of keys whose estimated similarity to the group's canonical (its first key in `key` order) is >= threshold, singletons excluded.
+        keys connected by candidate pairs are grouped first, a key only reaching the canonical through chained pairs starts its own group
+        """
+        parent = {}
+        def find(key):
+            parent.setdefault(key, key)
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+        for key1, key2 in self.candidate_pairs():
+            if self.similarity(key1, key2) >= self.threshold:
+                parent[find(key1)] = find(key2)
+        components = defaultdict(list)
+        for member in parent:
+            components[find(member)].append(member)
+        groups = []
+        for component in components.values():
+            remaining = sorted(component, key=key)
+            while len(remaining) > 1:
+                canonical = remaining[0]
+                group = [canonical] + [member for member in remaining[1:] if self.similarity(member, canonical) >= self.threshold]
+                if len(group) > 1:
+                    groups.append(group)
+                grouped = set(group)
+                remaining = [member for member in remaining if member not in grouped]
+        return groups
+
+def index_near_duplicates(store, threshold: float = 0.8, variant: str = 'raw', num_perm: int = 128, k: int = 5):
+    """
+    Build a MinHash LSH index over the corpus store and record duplicate / near-duplicate clusters in it,
+    each script points to the canonical (smallest RJ code and index) script of its cluster, see CorpusStore.canonical.
+    Signatures are cached in the store per content hash and parameters, so re-indexing only hashes new texts.
+    Texts with fewer than k characters after normalization have no shingles and are left out of the index.
+    Return the clusters as lists of (rj_code, idx).
+    """
+    hasher = MinHasher(num_perm, k)
+    params = f"{num_perm}:{k}"
+    cached = store.signatures(params)
+    index = LSHIndex(threshold, num_perm)
+    hash_keys = defaultdict(list)
+    new_signatures = {}
+    for record in store.iter_scripts(variant=variant):
+        if len(normalize_for_shingles(record.text)) < k:
+            continue
+        hash_keys[record.content_hash].append((record.rj_code, record.idx))
+        if record.content_hash not in cached and record.content_hash not in new_signatures:
+            new_signatures[record.content_hash] = hasher.signature(record.text)
+    store.put_signatures(params, new_signatures)
+    cached.update(new_signatures)
+    # exact duplicates share a content hash, only one signature per text goes into the index
+    for text_hash in hash_keys:
+        index.add(text_hash, cached[text_hash])
+    # the canonical of a cluster is its smallest (rj_code, idx), so order the texts by their first script
+    hash_clusters = index.clusters(key=lambda text_hash: hash_keys[text_hash][0])
+    clustered = {text_hash for group in hash_clusters for text_hash in group}
+    hash_clusters += [[text_hash] for text_hash, keys in hash_keys.items() if len(keys) > 1 and text_hash not in clustered]
+    key_hash = {key: text_hash for text_hash, keys in hash_keys.items() for key in keys}
+    clusters = sorted(sorted(key for text_hash in group for key in hash_keys[text_hash]) for group in hash_clusters)
+    duplicates = []
+    for cluster in clusters:
+        canonical = cluster[0]
+        for key in cluster[1:]:
+            same = key_hash[key] == key_hash[canonical]
+            similarity = 1.0 if same else index.similarity(key_hash[key], key_hash[canonical])
+            duplicates.append((*key, *canonical, similarity))
+    store.set_duplicates(variant, duplicates)
+    logger.info(f"{len(hash_keys)} unique texts, {len(clusters)} duplicate clusters, {len(duplicates)} redundant scripts")
+    return clusters
+
+if __name__ == "__main__":
+    import argparse
+    from corpus import CorpusStore
+    parser = argparse.ArgumentParser(description="index duplicate and near-duplicate scripts of a corpus store")
+    parser.add_argument('corpus', help="corpus store, e.g. scripts/corpus.sqlite3")
+    parser.add_argument('--threshold', type=float, default=0.8, help="estimated jaccard similarity of near duplicates")
+    parser.add_argument('--variant', default='raw')
+    parser.add_argument('--num-perm', type=int, default=128)
+    parser.add_argument('--shingle-size', type=int, default=5)
+    args = parser.parse_args()
+    with CorpusStore(args.corpus) as store:
+        for cluster in index_near_duplicates(store, args.threshold, args.variant, args.num_perm, args.shingle_size):
+            logger.info(f"{cluster[0]} <- {cluster[1:]}")
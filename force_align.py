@@ -11,6 +11,7 @@ from difflib import SequenceMatcher
 from typing import List, Tuple, Optional
 from dataclasses import dataclass
 import pandas as pd
+from segments import Segment, format_time, iter_segments, parse_time, read_segments, save, segments_path, TIME_PATTERN
 
 basicConfig(level=DEBUG)
 logger = getLogger(__name__)    
@@ -108,6 +109,8 @@ class TextSegment:
     start_time: float
     end_time: float
     line_text: str
+    confidence: Optional[float] = None
+    matched: bool = True
 
 @dataclass
 class LineSegment:
@@ -242,41 +245,35 @@ class JapaneseTextAligner:
             start_time=segments[start_idx].start_time,
             end_time=segments[end_idx].end_time,
             line_text=line,
+            confidence=confidence,
         )
 
     @staticmethod
     def _format_time(total_seconds):
-        if isinstance(total_seconds, str):
-            total_seconds = float(total_seconds)
-        if not isinstance(total_seconds, (int, float)):
-            raise TypeError("total_seconds must be a number")
-        minutes, seconds = divmod(total_seconds, 60)
-        if minutes >= 60.0:
-            hours, minutes = divmod(minutes, 60)
-            return f"{int(hours):02}:{int(minutes):02}:{seconds:05.2f}"
-        return f"{int(minutes):02}:{seconds:05.2f}"
+        return format_time(total_seconds)
     
     @staticmethod
     def _total_seconds(time_str):
-        minutes, seconds = map(float, time_str.split(':'))
-        return minutes * 60 + seconds
+        # mm:ss.xx and hh:mm:ss.xx
+        return parse_time(time_str)
     
-    def align_text(self, textgrid_path: str | Path):
+    def align_text(self, textgrid_path: str | Path, text: str = None, overwrite: bool = None):
         """
-        Align text lines with TextGrid timestamps, default text file is the same as the textgrid file with .txt extension
-        first align each line start and end timestamp with textgrid (file '.aligned.txt'), then merge lines that are too close to each other (file '.merged_aligned.txt')
-        side effect is to write a new text file with all lines' timestamps to ".aligned.txt" and another text with merged lines' timestamps to ".merged_aligned.txt"
+        Align text lines with TextGrid timestamps, default text file is the same as the textgrid file with .txt extension, pass text to align a script read elsewhere (e.g. from the corpus store)
+        overwrite: True/False overwrites or keeps an existing '.aligned.txt' without asking, None asks interactively
+        first align each line start and end timestamp with textgrid, then merge lines that are too close to each other
+        side effect is to write the merged lines' segments to ".aligned.seg.jsonl" and their text view to ".aligned.txt"
         the text and textgrid are only iterated only each once, each line content of text should be the same as textgrid or just one character difference, otherwise the alignmen will be wrong.
         """
-        MAX_MERGED_LINE_TIME = 28.0
         tg_path = Path(textgrid_path)
         if not tg_path.exists():
             return
-        text_path = tg_path.with_suffix('.txt')
-        if not text_path.exists():
-            return
-        with open(text_path, 'r', encoding='utf-8') as f:
-            text_lines = [line.strip() for line in f if line.strip()]
+        if text is None:
+            text_path = tg_path.with_suffix('.txt')
+            if not text_path.exists():
+                return
+            text = text_path.read_text(encoding='utf-8')
+        text_lines = [line.strip() for line in text.splitlines() if line.strip()]
         tg = textgrid.TextGrid.fromFile(tg_path)
         segments = self._get_word_segments(tg)    
 
@@ -288,40 +285,144 @@ class JapaneseTextAligner:
             all_line_timestamps.append(line_timestamp)
 
         # then merge lines that are too close to each other
-        merged_lines_txt = tg_path.with_suffix('.aligned.txt')
+        self._write_merged(all_line_timestamps, tg_path.with_suffix('.aligned.txt'), tg_path.stem, overwrite)
+
+    def _write_merged(self, all_line_timestamps: List[TextSegment], merged_lines_txt: Path, source: str, overwrite: bool = None):
+        """
+        merge consecutive aligned lines up to MAX_MERGED_LINE_TIME seconds, write their segments and the '.aligned.txt' view
+        unmatched lines have no timing of their own and are never merged
+        """
+        MAX_MERGED_LINE_TIME = 28.0
         if merged_lines_txt.exists():
-            response = input(f"{merged_lines_txt} already exists, do you want to overwrite it? (y/n)")
-            if response.lower().strip() == 'n':
+            if overwrite is None:
+                overwrite = input(f"{merged_lines_txt} already exists, do you want to overwrite it? (y/n)").lower().strip() != 'n'
+            if not overwrite:
                 return
         merged_line_timestamps = []
         current_start = all_line_timestamps[0].start_time
         current_end = all_line_timestamps[0].end_time
         current_text = all_line_timestamps[0].line_text
+        current_confidence = all_line_timestamps[0].confidence
+        current_matched = all_line_timestamps[0].matched
         for timestamp in all_line_timestamps[1:]:
-            if timestamp.end_time - current_start > MAX_MERGED_LINE_TIME:
-                merged_line_timestamps.append(TextSegment(current_start, current_end,current_text))
+            if timestamp.end_time - current_start > MAX_MERGED_LINE_TIME or not timestamp.matched or not current_matched:
+                merged_line_timestamps.append(TextSegment(current_start, current_end, current_text, current_confidence, current_matched))
                 current_start = timestamp.start_time
                 current_text = ""
+                current_confidence = timestamp.confidence
+                current_matched = timestamp.matched
             current_end = timestamp.end_time
             connector = "、" if re.search(fr'[{Japanese_characters}{Full_width_alpnums}]$', current_text) else ""
             current_text += connector + timestamp.line_text
-        merged_line_timestamps.append(TextSegment(current_start, current_end, current_text))
-        with open(merged_lines_txt, 'w', encoding='utf-8') as f:
-            for i, line in enumerate(merged_line_timestamps):
-                if i > 0 and merged_line_timestamps[i].start_time - merged_line_timestamps[i-1].end_time < 0.5:
-                    logger.warning(f"Merged_line {i+1} too close to previous line: {merged_line_timestamps[i].start_time - merged_line_timestamps[i-1].end_time:.2f} seconds")
-                line_num = i + 1
-                f.write(f"{self._format_time(line.start_time)}\t{self._format_time(line.end_time)}\t{line.line_text}\n")
+            current_confidence = min(current_confidence, timestamp.confidence)
+        merged_line_timestamps.append(TextSegment(current_start, current_end, current_text, current_confidence, current_matched))
+        for i in range(1, len(merged_line_timestamps)):
+            gap = merged_line_timestamps[i].start_time - merged_line_timestamps[i-1].end_time
+            if gap < 0.5:
+                logger.warning(f"Merged_line {i+1} too close to previous line: {gap:.2f} seconds")
+        save([Segment(line.start_time, line.end_time, line.line_text, line_num, line.confidence, source, unmatched=not line.matched)
+              for line_num, line in enumerate(merged_line_timestamps, 1)], merged_lines_txt, 'aligned')
+
+    def _asr_timeline(self, asr_segments) -> Tuple[str, List[float], List[float]]:
+        """
+        normalized hypothesis text with each character's start and end time, a chunk's duration is spread evenly over its characters
+        """
+        chars, starts, ends = [], [], []
+        for segment in asr_segments:
+            chunk = self._normalize_japanese(self._filter_non_japanese(segment.text))
+            if not chunk:
+                continue
+            step = (segment.end - segment.start) / len(chunk)
+            chars.append(chunk)
+            starts.extend(segment.start + i * step for i in range(len(chunk)))
+            ends.extend(segment.start + (i + 1) * step for i in range(len(chunk)))
+        return ''.join(chars), starts, ends
+
+    def _match_asr_lines(self, text_lines: List[str], hypothesis: str, starts: List[float], ends: List[float]) -> List[TextSegment]:
+        """
+        Map every script character to a hypothesis character with Levenshtein opcodes, a line spans its first to last mapped character,
+        confidence is the share of its characters matching the hypothesis exactly.
+        lines without any mapped character (e.g. stage directions) are unmatched, with confidence 0 and a placeholder span after the previous line
+        of at most MAX_LINE_TIME, they stay in the aligned view to be timed by hand, split_audio skips them otherwise
+        """
+        from rapidfuzz.distance import Levenshtein
+        MAX_LINE_TIME = 10.0
+        normalized = [self._normalize_japanese(self._filter_non_japanese(line)) for line in text_lines]
+        script = ''.join(normalized)
+        position = [None] * len(script)
+        exact = [False] * len(script)
+        for op in Levenshtein.opcodes(script, hypothesis):
+            if op.tag not in ('equal', 'replace'):
+                continue
+            src_len, dest_len = op.src_end - op.src_start, op.dest_end - op.dest_start
+            for k in range(src_len):
+                position[op.src_start + k] = op.dest_start + k * dest_len // src_len
+                exact[op.src_start + k] = op.tag == 'equal'
+        line_timestamps = []
+        offset = 0
+        for line_num, (line, chars) in enumerate(zip(text_lines, normalized), 1):
+            mapped = [p for p in position[offset:offset + len(chars)] if p is not None]
+            confidence = sum(exact[offset:offset + len(chars)]) / len(chars) if chars else 0.0
+            offset += len(chars)
+            if not mapped:
+                logger.error(f"Line {line_num} {line} is not in the transcription")
+                line_timestamps.append(TextSegment(None, None, line, 0.0, matched=False))
+                continue
+            if confidence < 0.6:
+                logger.error(f"Line {line_num} {line} has low confidence: {confidence:.2f}")
+            line_timestamps.append(TextSegment(starts[mapped[0]], ends[mapped[-1]], line, confidence))
+        # unmatched lines start at the previous matched end, and end before the next matched start
+        next_start = ends[-1] if ends else 0.0
+        for timestamp in reversed(line_timestamps):
+            if timestamp.start_time is None:
+                timestamp.end_time = next_start
+            else:
+                next_start = timestamp.start_time
+        previous_end = starts[0] if starts else 0.0
+        for timestamp in line_timestamps:
+            if timestamp.start_time is None:
+                timestamp.start_time = min(previous_end, timestamp.end_time)
+                timestamp.end_time = min(timestamp.end_time, timestamp.start_time + MAX_LINE_TIME)
+            else:
+                previous_end = timestamp.end_time
+        return line_timestamps
+
+    def align_asr(self, audio_path: str | Path, text: str = None, overwrite: bool = None):
+        """
+        Align text lines with ASR timestamps instead of a TextGrid, so no external forced aligner is needed.
+        ASR segments are read from the audio file with '.asr.txt' extension (see ASRInference.transcribe, chunk or word timestamps give the finest timing),
+        default text file is the audio file with .txt extension, overwrite is the same as align_text.
+        side effect is the same ".aligned.seg.jsonl" / ".aligned.txt" as align_text, so _format_check and split_audio follow unchanged
+        """
+        audio_path = Path(audio_path)
+        asr_path = audio_path.with_suffix('.asr.txt')
+        if not asr_path.exists() and not segments_path(asr_path).exists():
+            return
+        if text is None:
+            text_path = audio_path.with_suffix('.txt')
+            if not text_path.exists():
+                return
+            text = text_path.read_text(encoding='utf-8')
+        text_lines = [line.strip() for line in text.splitlines() if line.strip()]
+        hypothesis, starts, ends = self._asr_timeline(read_segments(asr_path))
+        if not text_lines or not hypothesis:
+            return
+        all_line_timestamps = self._match_asr_lines(text_lines, hypothesis, starts, ends)
+        self._write_merged(all_line_timestamps, audio_path.with_suffix('.aligned.txt'), audio_path.stem, overwrite)
     
     @ staticmethod
     def _format_check(text_path: str | Path, with_num: bool = False):
         """
         Check if the text file format is correct
         line_num | start_time | end_time | line_text
-        side effect is to write a new text file with all lines' timestamps to ".ok.txt"
+        the '.aligned.txt' view is read rather than its segments, since it is the file edited by hand,
+        the confidence of a line is taken from the segments when its times and text were not edited, an unmatched line stays unmatched until it is retimed
+        side effect is to write the checked segments to ".ok.seg.jsonl" and their text view to ".ok.txt"
         """
         logger.info(f"Format check start")
         text_path = Path(text_path)
+        manifest = segments_path(text_path)
+        aligned = dict(enumerate(iter_segments(manifest), 1)) if manifest.exists() else {}
         with open(text_path, 'r', encoding='utf-8') as f:
             texts = f.read()
         post_texts = postprocess_text(texts)
@@ -330,7 +431,7 @@ class JapaneseTextAligner:
         lines = post_texts.splitlines()
         line_num = 0
         checked_lines = []
-        line_pattern = r'^(\d{1,2})\t(\d{2}:\d{2}\.\d{2})\t(\d{2}:\d{2}\.\d{2})\t(.+)$' if with_num else r'^(\d{2}:\d{2}\.\d{2})\t(\d{2}:\d{2}\.\d{2})\t(.+)$'
+        line_pattern = fr'^(\d+)\t({TIME_PATTERN})\t({TIME_PATTERN})\t(.+)$' if with_num else fr'^({TIME_PATTERN})\t({TIME_PATTERN})\t(.+)$'
         for line_num, line in enumerate(lines, 1):
             line = line.strip()
             if not line:
@@ -346,40 +447,59 @@ class JapaneseTextAligner:
             start_time_format, end_time_format = map(JapaneseTextAligner._total_seconds, [start_time, end_time])
             if start_time_format > end_time_format or end_time_format - start_time_format > 29.60:
                 logger.warning(f"Line {line_num} time range error: {line}")
-            checked_lines.append(f'{line_num}\t{start_time}\t{end_time}\t{line_text}')
+            original = aligned.get(line_num)
+            retimed = original is None or (format_time(original.start), format_time(original.end)) != (start_time, end_time)
+            unchanged = not retimed and original.text.strip() == line_text.strip()
+            # an unmatched line keeps its placeholder span until it is timed by hand, text edits (e.g. by postprocess_text) don't time it
+            checked_lines.append(Segment(start_time_format, end_time_format, line_text, line_num, original.confidence if unchanged else None,
+                                         source=text_path.stem.replace('.aligned', ''), unmatched=not retimed and original.unmatched))
         output_path = Path(str(text_path).replace('.aligned', '.ok'))
-        output_path.write_text('\n'.join(checked_lines), encoding='utf-8')
+        save(checked_lines, output_path, 'ok')
         logger.info(f"Format check Done, {line_num} lines checked")
 
-def split_audio(audio_path: str | Path, out_path: str | Path = None):
+def split_audio(audio_path: str | Path, out_path: str | Path = None, pcm_cache=None):
     """
     Split audio based on timestamps,default audio path is the same as timestamps file with '.ok.txt' extension
+    the segments '.ok.seg.jsonl' are read when present, otherwise the '.ok.txt' view
+    pcm_cache: audio_cache.PCMCache, clips are sliced from the memory-mapped decoded audio and piped to ffmpeg for encoding only, None decodes the source once per clip
+    Return the paths of the written clips, existing clips are overwritten
     """
     audio = Path(audio_path)
     timestamps_path = audio.with_suffix('.ok.txt')
-    if not audio.exists() or not timestamps_path.exists():
+    if not audio.exists() or not (timestamps_path.exists() or segments_path(timestamps_path).exists()):
         return
     if (jscode := re.match(r'^RJ\d+', audio.stem)):
         jscode = jscode.group()
     output = audio.parent / jscode if out_path is None else Path(out_path)
     output.mkdir(parents=True, exist_ok=True)
     timestamps = []
-    with open(timestamps_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line_num = int(line.split('\t')[0])
-            start_time, end_time = map(JapaneseTextAligner._total_seconds, line.split('\t')[1:3])
-            text = line.split('\t')[3].strip()
-            timestamps.append(TextSegment(start_time, end_time, text))
-
-    timestamps.sort(key=lambda x: x.start_time)
+    for timestamp in read_segments(timestamps_path):
+        # a script line align_asr could not find in the audio, its span is a placeholder unless it was timed by hand
+        if timestamp.unmatched:
+            logger.warning(f"Skip unmatched line {timestamp.line_num} ({format_time(timestamp.start)}-{format_time(timestamp.end)}): {timestamp.text}")
+            continue
+        timestamps.append(timestamp)
+    timestamps.sort(key=lambda x: x.start)
+    pcm = None if pcm_cache is None else pcm_cache.load(audio)
+    clips = []
     for num, timestamp in enumerate(timestamps, 1):
         audio_out_path = output.joinpath(audio.stem + f"_{num}{audio.suffix}")
+        clips.append(audio_out_path)
         text_out_path = audio_out_path.with_suffix('.txt')
-        text_out_path.write_text(timestamp.line_text, encoding='utf-8')
+        text_out_path.write_text(timestamp.text, encoding='utf-8')
         logger.info(f"Split audio to {audio_out_path}")
-        start_time = timestamp.start_time - 0.20
-        end_time = timestamp.end_time + 0.20
+        start_time = timestamp.start - 0.20
+        end_time = timestamp.end + 0.20
+        if pcm is not None:
+            sample_rate = pcm_cache.sample_rate
+            clip = pcm[max(int(start_time * sample_rate), 0):int(end_time * sample_rate)]
+            cmd = [
+                "ffmpeg", "-nostdin", "-y", "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-i", "pipe:0", "-loglevel", "warning", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "128k", str(audio_out_path)
+            ]
+            subprocess.run(cmd, input=clip.tobytes(), check=True)
+            continue
         cmd = [
-            "ffmpeg", "-nostdin", "-threads", "0", "-i", str(audio_path), "-loglevel", "warning", "-ss", f"{start_time:.2f}", "-to", f"{end_time:.2f}", "-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "128k", str(audio_out_path)
+            "ffmpeg", "-nostdin", "-y", "-threads", "0", "-i", str(audio_path), "-loglevel", "warning", "-ss", f"{start_time:.2f}", "-to", f"{end_time:.2f}", "-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "128k", str(audio_out_path)
         ]
-        subprocess.run(cmd, check=True)
\ No newline at end of file
+        subprocess.run(cmd, check=True)
+    return clips
\ No newline at end of file
@@ -0,0 +1,157 @@
+# *-* coding: utf-8 *-*
+import os
+import json
+import fnmatch
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger, basicConfig, DEBUG
+
+import pandas as pd
+
+basicConfig(level=DEBUG)
+logger = getLogger(__name__)
+
+MANIFEST_COLUMNS = ['file_name', 'sentence', 'duration', 'num_samples', 'sample_rate',
+                    'audio_size', 'audio_mtime_ns', 'text_size', 'text_mtime_ns']
+MANIFEST_NAMES = {
+    'csv': 'metadata.csv',
+    'jsonl': 'metadata.jsonl',
+    'parquet': 'metadata.parquet',
+}
+
+def probe_audio(audio: str | Path):
+    """
+    Return (duration, num_samples, sample_rate) of an audio file, soundfile reads the header only, ffprobe is the fallback for formats libsndfile can't open
+    """
+    try:
+        import soundfile as sf
+        info = sf.info(str(audio))
+        return info.frames / info.samplerate, info.frames, info.samplerate
+    except Exception:
+        pass
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=sample_rate,duration_ts,duration", "-of", "json", str(audio)
+    ]
+    stream = json.loads(subprocess.run(cmd, check=True, capture_output=True).stdout)['streams'][0]
+    sample_rate = int(stream['sample_rate'])
+    duration = float(stream['duration'])
+    return duration, int(round(duration * sample_rate)), sample_rate
+
+def read_manifest(path: str | Path) -> pd.DataFrame:
+    """
+    Read a manifest in csv, jsonl or parquet format, return an empty frame if it doesn't exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path)
+    if path.suffix == '.jsonl':
+        return pd.read_json(path, lines=True, dtype={'sentence': str})
+    return pd.read_csv(path, dtype={'sentence': str}, keep_default_na=False)
+
+def write_manifest(df: pd.DataFrame, path: str | Path):
+    """
+    Write manifest atomically, format is chosen by the file suffix
+    """
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    if path.suffix == '.parquet':
+        df.to_parquet(tmp, index=False)
+    elif path.suffix == '.jsonl':
+        df.to_json(tmp, orient='records', lines=True, force_ascii=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+class ManifestBuilder:
+    """
+    Incremental, non-destructive manifest of audio clips and their sidecar '.txt' transcripts.
+    Only clips whose audio or transcript size/mtime changed since the previous manifest are read again, sidecars are kept.
+    The manifest could be loaded by datasets.load_dataset('audiofolder', ...) (csv/jsonl) or pandas.
+    """
+    def __init__(self, dataset_path: str | Path, fmt: str = 'csv', pattern: str = '*.mp3', num_workers: int = 16):
+        if fmt not in MANIFEST_NAMES:
+            raise ValueError(f"Unknown manifest format {fmt}, choose from {list(MANIFEST_NAMES)}")
+        self.dataset_path = Path(dataset_path)
+        self.manifest_path = self.dataset_path / MANIFEST_NAMES[fmt]
+        self.pattern = pattern
+        self.num_workers = num_workers
+
+    def _previous(self):
+        """
+        previous rows keyed by file name, any existing manifest format is accepted so switching format stays incremental
+        """
+        for path in [self.manifest_path] + [self.dataset_path / name for name in MANIFEST_NAMES.values()]:
+            if path.exists():
+                df = read_manifest(path)
+                if set(MANIFEST_COLUMNS) <= set(df.columns):
+                    return {row['file_name']: row for row in df.to_dict('records')}
+        return {}
+
+    def _scan(self):
+        """
+        stat audio and sidecar files, return list of (audio_entry, audio_stat, text_stat)
+        """
+        entries = [entry for entry in os.scandir(self.dataset_path) if entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern)]
+        def stat(entry):
+            text = Path(entry.path).with_suffix('.txt')
+            try:
+                return entry, entry.stat(), text.stat()
+            except FileNotFoundError:
+                return None
+        with ThreadPoolExecutor(self.num_workers) as pool:
+            return [item for item in pool.map(stat, entries) if item is not None]
+
+    @staticmethod
+    def _unchanged(row, audio_stat, text_stat):
+        return (row['audio_size'] == audio_stat.st_size and row['audio_mtime_ns'] == audio_stat.st_mtime_ns
+                and row['text_size'] == text_stat.st_size and row['text_mtime_ns'] == text_stat.st_mtime_ns)
+
+    @staticmethod
+    def _read_row(entry, audio_stat, text_stat):
+        audio = Path(entry.path)
+        sentence = audio.with_suffix('.txt').read_text(encoding='utf-8').strip()
+        duration, num_samples, sample_rate = probe_audio(audio)
+        return {
+            'file_name': entry.name,
+            'sentence': sentence,
+            'duration': duration,
+            'num_samples': num_samples,
+            'sample_rate': sample_rate,
+            'audio_size': audio_stat.st_size,
+            'audio_mtime_ns': audio_stat.st_mtime_ns,
+            'text_size': text_stat.st_size,
+            'text_mtime_ns': text_stat.st_mtime_ns,
+        }
+
+    def build(self) -> pd.DataFrame | None:
+        """
+        Refresh the manifest, return the manifest frame
+        """
+        if not self.dataset_path.exists():
+            return
+        previous = self._previous()
+        rows, stale = [], []
+        scanned = self._scan()
+        for entry, audio_stat, text_stat in scanned:
+            row = previous.get(entry.name)
+            if row is not None and self._unchanged(row, audio_stat, text_stat):
+                rows.append(row)
+            else:
+                stale.append((entry, audio_stat, text_stat))
+        def read(item):
+            try:
+                return self._read_row(*item)
+            except Exception as e:
+                logger.error(f"Failed to read {item[0].path}: {e}")
+        with ThreadPoolExecutor(self.num_workers) as pool:
+            rows.extend(row for row in pool.map(read, stale) if row is not None)
+        logger.info(f"Manifest {self.manifest_path}: {len(rows)} clips, {len(stale)} refreshed, {len(set(previous) - {entry.name for entry, _, _ in scanned})} removed")
+        df = pd.DataFrame(rows, columns=MANIFEST_COLUMNS).sort_values('file_name', ignore_index=True)
+        write_manifest(df, self.manifest_path)
+        return df
+
+def build_manifest(dataset_path: str | Path, fmt: str = 'csv', pattern: str = '*.mp3', num_workers: int = 16):
+    return ManifestBuilder(dataset_path, fmt, pattern, num_workers).build()
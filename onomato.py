@@ -260,13 +260,14 @@ def segment_to_words(text):
         segments.append(text[start:])
     return segments
 
-def filter_onomatopoeia_from_text(text):
+def filter_onomatopoeia_from_text(text, matcher=None):
     """
-    filter out onomatopoeia patterns from text
+    filter out onomatopoeia patterns from text, pass a matcher to reuse its compiled pattern across texts
     """
     text_final = preprocess_text(text)
     text_segments = segment_to_words(text_final)
-    matcher = OnomatopoeiaPatternMatcher('onomato.txt')
+    if matcher is None:
+        matcher = OnomatopoeiaPatternMatcher('onomato.txt')
     @lru_cache(maxsize=None)
     def is_onomato(subword):
         return matcher.is_match(subword)
@@ -284,6 +285,29 @@ def filter_onomatopoeia_from_text(text):
     result = postprocess_text(result)
     return result
 
+def filter_onomatopoeia_from_corpus(store, rj_codes=None, variant='filtered'):
+    """
+    stream raw scripts from a corpus.CorpusStore and store the filtered texts next to them as `variant`, return number of scripts filtered.
+    A script whose raw text is an exact duplicate of its canonical script (see dedup.index_near_duplicates) reuses the canonical's filtered text
+    """
+    matcher = OnomatopoeiaPatternMatcher('onomato.txt')
+    count = reused = 0
+    for rj_code in (store.rj_codes() if rj_codes is None else rj_codes):
+        # read one work at a time, writes don't interleave with the open read cursor
+        for record in list(store.iter_scripts(rj_code)):
+            canonical = store.canonical(record.rj_code, record.idx)
+            filtered = store.get(*canonical[:2], variant=variant) if canonical and canonical[2] == 1.0 else None
+            if filtered is not None:
+                text = filtered.text
+                reused += 1
+            else:
+                text = filter_onomatopoeia_from_text(record.text, matcher)
+            store.put(record.rj_code, record.idx, record.title, text, variant=variant, source_url=record.source_url)
+            count += 1
+    if reused:
+        logger.info(f"{reused} of {count} scripts are exact duplicates, reused the filtered text of their canonical script")
+    return count
+
 def normalize_japanese_text(text):
     """
     Normalize Japanese text by converting full-width characters to half-width, removing whitespace, and converting to lowercase
@@ -300,9 +324,8 @@ def normalize_japanese_text(text):
         text = text.replace(key, value)
     return text
 
-from rapidfuzz.distance import Levenshtein
-
 def compare_texts_char_level_with_positions(text1, text2):
+    from rapidfuzz.distance import Levenshtein
     # Split texts by punctuation
     pattern = r'([。、！？「」『』（）…!?\.{3,}\s]+)'
     
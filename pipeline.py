@@ -0,0 +1,314 @@
+# *-* coding: utf-8 *-*
+"""
+Incremental orchestrator for the per-work pipeline
+
+    audio (X.mp3) --vad--> X.vad.seg.jsonl --asr--> X.asr.seg.jsonl
+    X.TextGrid + X.txt --align--> X.aligned.txt --format_check--> X.ok.seg.jsonl --split--> clips in dataset_dir --manifest--> metadata.csv
+
+With align_mode='asr' the align stage uses the timestamped ASR chunks (X.asr.seg.jsonl + X.txt) instead of a TextGrid,
+so audio and script go to clips without the external forced aligner.
+
+Timing passes between stages as segment manifests (segments.py), each with its '.txt' view. The format check reads the
+'.aligned.txt' view instead of the manifest because that is the file corrected by hand.
+
+Every stage declares its input and output files, a stage's key is the hash of its input contents and parameters.
+A stage only runs when an output is missing or its key changed since the last run (like make, but content based), stages whose inputs
+don't exist yet (e.g. no TextGrid from the external aligner) are blocked together with their dependents.
+With a corpus store (corpus.py), a work whose script is a duplicate of another work's script in the same run (see dedup.py) and whose audio
+is the same recording is skipped, its clips would repeat the ones of the canonical work.
+Works run in parallel, each stage runs on the executor of its resource: 'gpu' stages in a single in-process thread
+(one model stays loaded), 'cpu' stages in a pool of worker processes.
+"""
+import json
+import hashlib
+import threading
+from pathlib import Path
+from functools import lru_cache
+from dataclasses import dataclass, field
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from logging import getLogger, basicConfig, DEBUG
+
+basicConfig(level=DEBUG)
+logger = getLogger(__name__)
+
+STAMP_DIR = '.pipeline'
+
+@lru_cache(maxsize=None)
+def _pcm_cache(enabled: bool):
+    from audio_cache import PCMCache
+    return PCMCache() if enabled else None
+
+@lru_cache(maxsize=None)
+def _voice_detector(backend: str, pcm_cache: bool = False):
+    from utils import VoiceDetector
+    return VoiceDetector(backend, pcm_cache=_pcm_cache(pcm_cache))
+
+@lru_cache(maxsize=None)
+def _asr_model(model: str, batch_size: int, timestamps: bool | str = None, pcm_cache: bool = False):
+    from caption import ASRInference
+    return ASRInference(model_id=model, batch_size=batch_size, return_timestamps=timestamps, pcm_cache=_pcm_cache(pcm_cache))
+
+def run_vad(audio: Path, manifest: Path, view: Path, backend: str, pcm_cache: bool = False):
+    _voice_detector(backend, pcm_cache)(audio, view)
+
+def run_asr(audio: Path, vad: Path, manifest: Path, view: Path, model: str, batch_size: int, timestamps: bool | str = None, pcm_cache: bool = False):
+    _asr_model(model, batch_size, timestamps, pcm_cache).transcribe(audio, vad, view)
+
+def run_align(textgrid: Path, script: Path, manifest: Path, view: Path):
+    from force_align import JapaneseTextAligner
+    JapaneseTextAligner().align_text(textgrid, script.read_text(encoding='utf-8'), overwrite=True)
+
+def run_align_asr(audio: Path, asr: Path, script: Path, manifest: Path, view: Path):
+    from force_align import JapaneseTextAligner
+    JapaneseTextAligner().align_asr(audio, script.read_text(encoding='utf-8'), overwrite=True)
+
+def run_format_check(aligned: Path, manifest: Path, view: Path):
+    from force_align import JapaneseTextAligner
+    JapaneseTextAligner._format_check(aligned)
+
+def run_split(audio: Path, ok: Path, marker: Path, dataset_dir: Path, pcm_cache: bool = False):
+    from force_align import split_audio
+    # remove the clips of the previous split, a script with fewer lines would leave stale clips in the dataset
+    if marker.exists():
+        for name in marker.read_text(encoding='utf-8').splitlines():
+            clip = dataset_dir / name
+            clip.unlink(missing_ok=True)
+            clip.with_suffix('.txt').unlink(missing_ok=True)
+    clips = split_audio(audio, dataset_dir, _pcm_cache(pcm_cache)) or []
+    marker.write_text('\n'.join(clip.name for clip in clips), encoding='utf-8')
+
+@dataclass
+class Stage:
+    """
+    name: stage name, deps: stages which must be up to date first, resource: 'cpu' or 'gpu'
+    inputs/outputs: work audio path -> list of file paths, run: called as run(*inputs, *outputs, **params)
+    """
+    name: str
+    run: Callable
+    inputs: Callable[[Path], list[Path]]
+    outputs: Callable[[Path], list[Path]]
+    deps: list[str] = field(default_factory=list)
+    resource: str = 'cpu'
+    params: dict = field(default_factory=dict)
+
+def _segment_files(name: str):
+    """outputs of a segment writing stage: the manifest and its text view"""
+    return lambda a: [a.with_suffix(f'.{name}.seg.jsonl'), a.with_suffix(f'.{name}.txt')]
+
+def default_stages(dataset_dir: str | Path, vad_backend: str = 'pyannote', asr_model: str = None, asr_batch_size: int = 16,
+                   align_mode: str = 'textgrid', asr_timestamps: bool | str = None, pcm_cache: bool = True) -> list[Stage]:
+    """
+    align_mode: 'textgrid' aligns to the external aligner's X.TextGrid, 'asr' to the ASR chunk timestamps (needs asr_model, timestamps default to chunk level)
+    pcm_cache: vad, asr and split read the audio decoded once into '.pcm_cache' next to it (see audio_cache.py) instead of decoding it each
+    """
+    if align_mode not in ('textgrid', 'asr'):
+        raise ValueError(f"Unknown align mode {align_mode}")
+    if align_mode == 'asr' and asr_model is None:
+        raise ValueError("align_mode 'asr' needs an asr_model")
+    if align_mode == 'asr' and asr_timestamps is None:
+        asr_timestamps = True
+    dataset_dir = Path(dataset_dir)
+    if align_mode == 'asr':
+        align = Stage('align', run_align_asr, lambda a: [a, a.with_suffix('.asr.seg.jsonl'), a.with_suffix('.txt')], _segment_files('aligned'), deps=['asr'])
+    else:
+        align = Stage('align', run_align, lambda a: [a.with_suffix('.TextGrid'), a.with_suffix('.txt')], _segment_files('aligned'))
+    stages = [
+        Stage('vad', run_vad, lambda a: [a], _segment_files('vad'),
+              resource='gpu' if vad_backend == 'pyannote' else 'cpu', params={'backend': vad_backend, 'pcm_cache': pcm_cache}),
+        align,
+        Stage('format_check', run_format_check, lambda a: [a.with_suffix('.aligned.txt')], _segment_files('ok'), deps=['align']),
+        Stage('split', run_split, lambda a: [a, a.with_suffix('.ok.seg.jsonl')], lambda a: [a.parent / STAMP_DIR / f'{a.stem}.split'],
+              deps=['format_check'], params={'dataset_dir': dataset_dir, 'pcm_cache': pcm_cache}),
+    ]
+    if asr_model is not None:
+        stages.insert(1, Stage('asr', run_asr, lambda a: [a, a.with_suffix('.vad.seg.jsonl')], _segment_files('asr'),
+                               deps=['vad'], resource='gpu', params={'model': asr_model, 'batch_size': asr_batch_size, 'timestamps': asr_timestamps, 'pcm_cache': pcm_cache}))
+    return stages
+
+class StampStore:
+    """
+    Per-work record of file content hashes (cached by size and mtime) and the key each stage was last built with
+    """
+    def __init__(self, audio: Path):
+        self.path = audio.parent / STAMP_DIR / f'{audio.stem}.json'
+        self.data = json.loads(self.path.read_text(encoding='utf-8')) if self.path.exists() else {'files': {}, 'stages': {}}
+
+    def file_hash(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self.data['files'].get(str(path))
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.data['files'][str(path)] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def stage_key(self, stage: Stage, inputs: list[Path]) -> str:
+        payload = json.dumps({
+            'stage': stage.name,
+            'inputs': [self.file_hash(path) for path in inputs],
+            'params': stage.params,
+        }, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def is_fresh(self, stage: Stage, key: str, outputs: list[Path]) -> bool:
+        return self.data['stages'].get(stage.name) == key and all(path.exists() for path in outputs)
+
+    def record(self, stage: Stage, key: str):
+        self.data['stages'][stage.name] = key
+        self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f'.{self.path.name}.tmp')
+        tmp.write_text(json.dumps(self.data, indent=1), encoding='utf-8')
+        tmp.replace(self.path)
+
+class Orchestrator:
+    """
+    Run the stages for every work, rebuild only stale artifacts, works in parallel under per-resource limits
+    """
+    def __init__(self, stages: list[Stage], dataset_dir: str | Path, cpu_workers: int = 4, gpu_workers: int = 1, max_works: int = None,
+                 corpus: str | Path = None):
+        self.stages = self._toposort(stages)
+        self.dataset_dir = Path(dataset_dir)
+        self.cpu_workers = cpu_workers
+        self.gpu_workers = gpu_workers
+        self.executors = {}
+        self.max_works = max_works or cpu_workers + gpu_workers
+        self.corpus = corpus
+        self.lock = threading.Lock()
+        self.report = {}
+        self.duplicates = {}
+
+    @staticmethod
+    def _toposort(stages: list[Stage]) -> list[Stage]:
+        by_name = {stage.name: stage for stage in stages}
+        ordered, done, visiting = [], set(), set()
+        def visit(stage):
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise ValueError(f"Cycle in pipeline at stage {stage.name}")
+            visiting.add(stage.name)
+            for dep in stage.deps:
+                visit(by_name[dep])
+            done.add(stage.name)
+            ordered.append(stage)
+        for stage in stages:
+            visit(stage)
+        return ordered
+
+    def _duplicate_works(self, audios: list[Path]) -> dict[Path, Path]:
+        """
+        {audio: audio of its canonical work} for works whose script (X.txt) has the same canonical script in the corpus as an earlier work
+        and whose audio has the same content
+        """
+        from corpus import CorpusStore, content_hash
+        duplicates, first = {}, {}
+        with CorpusStore(self.corpus) as store:
+            for audio in audios:
+                script = audio.with_suffix('.txt')
+                keys = store.find(content_hash(script.read_text(encoding='utf-8'))) if script.exists() else []
+                if not keys:
+                    continue
+                canonical = store.canonical(*keys[0])
+                stamps = StampStore(audio)
+                group = (canonical[:2] if canonical else keys[0], stamps.file_hash(audio))
+                stamps.save()
+                if group in first:
+                    duplicates[audio] = first[group]
+                    logger.info(f"{audio.name}: duplicate of {first[group].name}, skipped")
+                else:
+                    first[group] = audio
+        return duplicates
+
+    def _run_work(self, audio: Path):
+        if audio in self.duplicates:
+            status = {stage.name: 'duplicate' for stage in self.stages}
+            with self.lock:
+                self.report[audio.name] = status
+            return status
+        stamps = StampStore(audio)
+        status = {}
+        for stage in self.stages:
+            if any(status[dep] in ('blocked', 'failed') for dep in stage.deps):
+                status[stage.name] = 'blocked'
+                continue
+            inputs, outputs = stage.inputs(audio), stage.outputs(audio)
+            missing = [path for path in inputs if not path.exists()]
+            if missing:
+                logger.info(f"{audio.name} {stage.name}: waiting for {[path.name for path in missing]}")
+                status[stage.name] = 'blocked'
+                continue
+            key = stamps.stage_key(stage, inputs)
+            if stamps.is_fresh(stage, key, outputs):
+                status[stage.name] = 'fresh'
+                continue
+            for path in outputs:
+                path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                self.executors[stage.resource].submit(stage.run, *inputs, *outputs, **stage.params).result()
+            except Exception as e:
+                logger.error(f"{audio.name} {stage.name} failed: {e}")
+                status[stage.name] = 'failed'
+                continue
+            stamps.record(stage, key)
+            status[stage.name] = 'built'
+            logger.info(f"{audio.name} {stage.name}: built")
+        with self.lock:
+            self.report[audio.name] = status
+        return status
+
+    def run(self, audios: list[Path], manifest: bool = True):
+        """
+        Run the pipeline for the audio files, then refresh the dataset manifest if any clips were split, return {audio name: {stage: status}}
+        """
+        self.dataset_dir.mkdir(parents=True, exist_ok=True)
+        self.duplicates = self._duplicate_works(audios) if self.corpus else {}
+        # the executors live for one run, so the orchestrator can run again after they are shut down
+        self.executors = {
+            'gpu': ThreadPoolExecutor(self.gpu_workers, thread_name_prefix='gpu'),
+            'cpu': ProcessPoolExecutor(self.cpu_workers),
+        }
+        try:
+            with ThreadPoolExecutor(self.max_works, thread_name_prefix='work') as works:
+                list(works.map(self._run_work, audios))
+        finally:
+            for executor in self.executors.values():
+                executor.shutdown()
+        if manifest and any(status.get('split') == 'built' for status in self.report.values()):
+            from manifest import build_manifest
+            build_manifest(self.dataset_dir)
+        return self.report
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="incremental VAD / ASR / alignment / split / manifest pipeline")
+    parser.add_argument('work_dir', help="folder with the source audio files and their scripts / TextGrids")
+    parser.add_argument('dataset_dir', help="folder receiving the split clips and the manifest")
+    parser.add_argument('--pattern', default='*.mp3')
+    parser.add_argument('--vad-backend', default='pyannote', choices=('pyannote', 'energy'))
+    parser.add_argument('--asr-model', default=None, help="model id for the asr stage, the stage is skipped without it")
+    parser.add_argument('--asr-batch-size', type=int, default=16)
+    parser.add_argument('--align-mode', default='textgrid', choices=('textgrid', 'asr'), help="'asr' aligns scripts to asr timestamps, no TextGrid needed")
+    parser.add_argument('--asr-timestamps', default=None, choices=('chunk', 'word'), help="timestamp level of the asr stage, chunk by default with --align-mode asr")
+    parser.add_argument('--no-pcm-cache', action='store_true', help="decode the audio in every stage instead of caching the decoded pcm")
+    parser.add_argument('--cpu-workers', type=int, default=4)
+    parser.add_argument('--gpu-workers', type=int, default=1)
+    parser.add_argument('--corpus', default=None, help="corpus store of the scripts, works duplicating an earlier work's script and audio are skipped")
+    parser.add_argument('--dedup-threshold', type=float, default=0.8, help="similarity of near-duplicate scripts, used with --corpus")
+    args = parser.parse_args()
+    if args.corpus:
+        from corpus import CorpusStore
+        from dedup import index_near_duplicates
+        with CorpusStore(args.corpus) as store:
+            index_near_duplicates(store, args.dedup_threshold)
+    asr_timestamps = {None: None, 'chunk': True, 'word': 'word'}[args.asr_timestamps]
+    stages = default_stages(args.dataset_dir, args.vad_backend, args.asr_model, args.asr_batch_size, args.align_mode, asr_timestamps, not args.no_pcm_cache)
+    orchestrator = Orchestrator(stages, args.dataset_dir, args.cpu_workers, args.gpu_workers, corpus=args.corpus)
+    for name, status in orchestrator.run(sorted(Path(args.work_dir).glob(args.pattern))).items():
+        logger.info(f"{name}: {status}")
@@ -0,0 +1,161 @@
+# *-* coding: utf-8 *-*
+"""
+Segment manifest shared by VAD, ASR, aligner, format check and splitter.
+Segments are stored as JSONL (one segment per line, times in float seconds) in '<name>.seg.jsonl' next to the
+human readable text view '<name>.txt', the text view is always rendered from the segments.
+"""
+import os
+import json
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from typing import Iterable, Iterator, Optional
+import regex as re
+
+SEGMENT_SUFFIX = '.seg.jsonl'
+TIME_PATTERN = r'(?:\d+:)?\d{1,2}:\d{2}(?:\.\d+)?'
+
+@dataclass
+class Segment:
+    """
+    One timed segment, start/end in seconds, line_num is 1-based (0 when not tied to a script line),
+    unmatched marks a script line the aligner could not find in the audio, its span is a placeholder
+    """
+    start: float
+    end: float
+    text: str = ''
+    line_num: int = 0
+    confidence: Optional[float] = None
+    source: Optional[str] = None
+    unmatched: bool = False
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+def format_time(total_seconds) -> str:
+    """
+    seconds to 'mm:ss.xx', or 'hh:mm:ss.xx' from one hour on
+    """
+    if isinstance(total_seconds, str):
+        total_seconds = float(total_seconds)
+    if not isinstance(total_seconds, (int, float)):
+        raise TypeError("total_seconds must be a number")
+    minutes, seconds = divmod(total_seconds, 60)
+    if minutes >= 60.0:
+        hours, minutes = divmod(minutes, 60)
+        return f"{int(hours):02}:{int(minutes):02}:{seconds:05.2f}"
+    return f"{int(minutes):02}:{seconds:05.2f}"
+
+def parse_time(time_str: str) -> float:
+    """
+    'mm:ss.xx' or 'hh:mm:ss.xx' (or plain seconds) to seconds
+    """
+    total = 0.0
+    for part in time_str.strip().split(':'):
+        total = total * 60 + float(part)
+    return total
+
+def offset_chunks(chunks, start_time: float, end_time: float) -> list[dict]:
+    """
+    ASR chunk timestamps relative to their segment to absolute times clipped to the segment,
+    the last end is None when the model stops mid chunk
+    """
+    offset = []
+    for chunk in chunks:
+        chunk_start, chunk_end = chunk['timestamp']
+        chunk_start = start_time + (chunk_start or 0.0)
+        chunk_end = end_time if chunk_end is None else min(start_time + chunk_end, end_time)
+        offset.append({'text': chunk['text'], 'timestamp': (chunk_start, max(chunk_start, chunk_end))})
+    return offset
+
+def segments_path(path: str | Path) -> Path:
+    """
+    the segment manifest belonging to a text view, 'X.aligned.txt' -> 'X.aligned.seg.jsonl'
+    """
+    path = Path(path)
+    if path.name.endswith(SEGMENT_SUFFIX):
+        return path
+    return path.with_suffix(SEGMENT_SUFFIX)
+
+def write_segments(segments: Iterable[Segment], path: str | Path) -> Path:
+    """
+    Write segments as JSONL atomically, return the manifest path
+    """
+    path = segments_path(path)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for segment in segments:
+            f.write(json.dumps(asdict(segment), ensure_ascii=False) + '\n')
+    os.replace(tmp, path)
+    return path
+
+def iter_segments(path: str | Path) -> Iterator[Segment]:
+    """
+    Stream segments from a manifest, one line at a time
+    """
+    with open(segments_path(path), 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield Segment(**json.loads(line))
+
+def _parse_text_line(line: str) -> Optional[Segment]:
+    """
+    legacy tab separated views: 'start\\tend\\tlabel' (VAD, seconds), 'mm:ss.xx\\tmm:ss.xx\\ttext' (aligned), 'num\\tmm:ss.xx\\tmm:ss.xx\\ttext' (ok)
+    """
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) >= 4 and fields[0].isdigit() and re.fullmatch(TIME_PATTERN, fields[1]):
+        return Segment(parse_time(fields[1]), parse_time(fields[2]), fields[3].strip(), int(fields[0]))
+    if len(fields) >= 3 and re.fullmatch(TIME_PATTERN, fields[0]):
+        return Segment(parse_time(fields[0]), parse_time(fields[1]), fields[2].strip())
+    if len(fields) >= 2:
+        try:
+            return Segment(float(fields[0]), float(fields[1]), fields[2].strip() if len(fields) > 2 else '')
+        except ValueError:
+            return None
+    return None
+
+def read_segments(path: str | Path) -> Iterator[Segment]:
+    """
+    Stream segments for a text view or manifest path, the manifest is used when it exists,
+    otherwise (or when the view was edited after the manifest was written) the text view is parsed
+    """
+    path = Path(path)
+    manifest = segments_path(path)
+    if manifest.exists() and (manifest == path or not path.exists() or path.stat().st_mtime_ns <= manifest.stat().st_mtime_ns):
+        yield from iter_segments(manifest)
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            segment = _parse_text_line(line)
+            if segment is not None:
+                if not segment.line_num:
+                    segment.line_num = line_num
+                yield segment
+
+VIEW_FORMATS = {
+    # VAD labels, seconds with 2 decimals
+    'vad': lambda s: f'{s.start:.2f}\t{s.end:.2f}\t{s.text}',
+    # aligner output, edited by hand before the format check
+    'aligned': lambda s: f'{format_time(s.start)}\t{format_time(s.end)}\t{s.text}',
+    # format checked lines consumed by the splitter
+    'ok': lambda s: f'{s.line_num}\t{format_time(s.start)}\t{format_time(s.end)}\t{s.text}',
+}
+
+def write_view(segments: Iterable[Segment], path: str | Path, fmt: str) -> Path:
+    """
+    Render the human readable text view of segments
+    """
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_text('\n'.join(VIEW_FORMATS[fmt](segment) for segment in segments) + '\n', encoding='utf-8')
+    os.replace(tmp, path)
+    return path
+
+def save(segments: Iterable[Segment], view_path: str | Path, fmt: str) -> Path:
+    """
+    Render the view of view_path and write its segment manifest, return the manifest path
+    the view is written first, so a view newer than its manifest has been edited by hand
+    """
+    segments = list(segments)
+    write_view(segments, view_path, fmt)
+    return write_segments(segments, view_path)
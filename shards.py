@@ -0,0 +1,232 @@
+# *-* coding: utf-8 *-*
+import io
+import os
+import json
+import time
+import tarfile
+from pathlib import Path
+from logging import getLogger, basicConfig, DEBUG
+
+import numpy as np
+
+from manifest import build_manifest
+from utils import stream_pcm, SAMPLE_RATE
+
+basicConfig(level=DEBUG)
+logger = getLogger(__name__)
+
+SHARD_INDEX = 'index.json'
+SHARD_FORMATS = ('tar', 'parquet')
+AUDIO_CODECS = ('flac', 'pcm')
+
+def _decode(audio: Path) -> np.ndarray:
+    return np.concatenate(list(stream_pcm(audio, SAMPLE_RATE * 30)) or [np.zeros(0, dtype=np.float32)])
+
+def _encode(waveform: np.ndarray, codec: str) -> bytes:
+    """
+    encode float32 mono waveform, 'pcm' is raw little-endian int16, 'flac' is 16 bit flac
+    """
+    pcm = (np.clip(waveform, -1.0, 1.0) * 32767).astype('<i2')
+    if codec == 'pcm':
+        return pcm.tobytes()
+    import soundfile as sf
+    buffer = io.BytesIO()
+    sf.write(buffer, pcm, SAMPLE_RATE, format='FLAC', subtype='PCM_16')
+    return buffer.getvalue()
+
+def _decode_bytes(data: bytes, codec: str) -> np.ndarray:
+    if codec == 'pcm':
+        return np.frombuffer(data, dtype='<i2').astype(np.float32) / 32767
+    import soundfile as sf
+    waveform, _ = sf.read(io.BytesIO(data), dtype='float32')
+    return waveform
+
+class _TarShardWriter:
+    def __init__(self, path: Path, codec: str):
+        self.path = path
+        self.codec = codec
+        self.tar = tarfile.open(path, 'w')
+
+    def _add(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def write(self, key: str, audio: bytes, sentence: str, meta: dict):
+        # webdataset layout, files of one sample share the key and are adjacent
+        self._add(f'{key}.{self.codec}', audio)
+        self._add(f'{key}.txt', sentence.encode('utf-8'))
+        self._add(f'{key}.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def close(self):
+        self.tar.close()
+
+class _ParquetShardWriter:
+    def __init__(self, path: Path, codec: str):
+        self.path = path
+        self.codec = codec
+        self.rows = []
+
+    def write(self, key: str, audio: bytes, sentence: str, meta: dict):
+        self.rows.append({'key': key, 'audio': audio, 'sentence': sentence, 'meta': json.dumps(meta, ensure_ascii=False)})
+
+    def close(self):
+        import pandas as pd
+        pd.DataFrame(self.rows).to_parquet(self.path, index=False)
+
+def pack_shards(dataset_path: str | Path, out_path: str | Path, fmt: str = 'tar', codec: str = 'flac', shard_size: int = 256 * 1024 * 1024):
+    """
+    Pack split clips and their transcripts of dataset_path into shards of about shard_size bytes, audio is decoded once to 16 kHz mono and stored as flac or raw int16 pcm.
+    The clip list comes from the dataset manifest (see manifest.build_manifest), the shard index (index.json) lists every shard with its sample count and byte size.
+    """
+    if fmt not in SHARD_FORMATS:
+        raise ValueError(f"Unknown shard format {fmt}, choose from {list(SHARD_FORMATS)}")
+    if codec not in AUDIO_CODECS:
+        raise ValueError(f"Unknown audio codec {codec}, choose from {list(AUDIO_CODECS)}")
+    dataset_path, out_path = Path(dataset_path), Path(out_path)
+    manifest = build_manifest(dataset_path)
+    if manifest is None or manifest.empty:
+        return
+    out_path.mkdir(parents=True, exist_ok=True)
+    writer_cls = _TarShardWriter if fmt == 'tar' else _ParquetShardWriter
+    shards = []
+    writer, num_samples, num_bytes = None, 0, 0
+
+    def finish():
+        writer.close()
+        shards.append({'file': writer.path.name, 'num_samples': num_samples, 'num_bytes': writer.path.stat().st_size})
+        logger.info(f"Shard {writer.path} done, {num_samples} samples")
+
+    for row in manifest.itertuples(index=False):
+        if writer is None:
+            writer = writer_cls(out_path / f'shard-{len(shards):05d}.{fmt}', codec)
+            num_samples, num_bytes = 0, 0
+        waveform = _decode(dataset_path / row.file_name)
+        audio = _encode(waveform, codec)
+        key = Path(row.file_name).stem
+        writer.write(key, audio, row.sentence, {'file_name': row.file_name, 'num_samples': len(waveform), 'sampling_rate': SAMPLE_RATE})
+        num_samples += 1
+        num_bytes += len(audio)
+        if num_bytes >= shard_size:
+            finish()
+            writer = None
+    if writer is not None:
+        finish()
+    index = {'format': fmt, 'codec': codec, 'sampling_rate': SAMPLE_RATE, 'shards': shards}
+    tmp = out_path / f'.{SHARD_INDEX}.tmp'
+    tmp.write_text(json.dumps(index, indent=2), encoding='utf-8')
+    os.replace(tmp, out_path / SHARD_INDEX)
+    return out_path / SHARD_INDEX
+
+def _iter_tar(path: Path, codec: str):
+    sample = {}
+    # stream mode, members are read strictly sequentially
+    with tarfile.open(path, 'r|') as tar:
+        for member in tar:
+            key, ext = member.name.rsplit('.', 1)
+            if sample and sample['key'] != key:
+                yield sample
+                sample = {}
+            data = tar.extractfile(member).read()
+            sample['key'] = key
+            if ext == codec:
+                sample['audio'] = {'array': _decode_bytes(data, codec), 'sampling_rate': SAMPLE_RATE}
+            elif ext == 'txt':
+                sample['sentence'] = data.decode('utf-8')
+            elif ext == 'json':
+                sample['meta'] = json.loads(data)
+    if sample:
+        yield sample
+
+def _iter_parquet(path: Path, codec: str):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=64):
+        for row in batch.to_pylist():
+            yield {
+                'key': row['key'],
+                'audio': {'array': _decode_bytes(row['audio'], codec), 'sampling_rate': SAMPLE_RATE},
+                'sentence': row['sentence'],
+                'meta': json.loads(row['meta']),
+            }
+
+def iter_shards(index_path: str | Path, shard_ids=None):
+    """
+    Stream samples {'key', 'audio': {'array', 'sampling_rate'}, 'sentence', 'meta'} shard by shard, shard_ids selects a subset of shards
+    """
+    index_path = Path(index_path)
+    if index_path.is_dir():
+        index_path = index_path / SHARD_INDEX
+    index = json.loads(index_path.read_text(encoding='utf-8'))
+    reader = _iter_tar if index['format'] == 'tar' else _iter_parquet
+    shards = index['shards'] if shard_ids is None else [index['shards'][i] for i in shard_ids]
+    for shard in shards:
+        yield from reader(index_path.parent / shard['file'], index['codec'])
+
+def shard_dataset(index_path: str | Path):
+    """
+    torch IterableDataset over the shards, shards are split between DataLoader workers so each worker reads its own files sequentially
+    """
+    from torch.utils.data import IterableDataset, get_worker_info
+
+    class ShardDataset(IterableDataset):
+        def __iter__(self):
+            index_file = Path(index_path) / SHARD_INDEX if Path(index_path).is_dir() else Path(index_path)
+            num_shards = len(json.loads(index_file.read_text(encoding='utf-8'))['shards'])
+            worker = get_worker_info()
+            shard_ids = range(num_shards) if worker is None else range(worker.id, num_shards, worker.num_workers)
+            return iter_shards(index_file, shard_ids)
+
+    return ShardDataset()
+
+def hf_dataset(index_path: str | Path):
+    """
+    datasets.IterableDataset over the shards
+    """
+    from datasets import IterableDataset
+    return IterableDataset.from_generator(iter_shards, gen_kwargs={'index_path': str(index_path)})
+
+def benchmark_loading(dataset_path: str | Path, index_path: str | Path, limit: int = None):
+    """
+    Compare loader throughput of loose clips (manifest + per-file mp3 decoding) with the packed shards, return samples/s and audio seconds/s of both
+    """
+    import pandas as pd
+    from manifest import read_manifest, MANIFEST_NAMES
+    dataset_path = Path(dataset_path)
+    manifest = read_manifest(dataset_path / MANIFEST_NAMES['csv'])
+    if limit is not None:
+        manifest = manifest.head(limit)
+
+    def loose():
+        for row in manifest.itertuples(index=False):
+            sentence = (dataset_path / row.file_name).with_suffix('.txt').read_text(encoding='utf-8')
+            yield {'audio': {'array': _decode(dataset_path / row.file_name)}, 'sentence': sentence}
+
+    def measure(samples):
+        count, seconds = 0, 0.0
+        start = time.perf_counter()
+        for sample in samples:
+            count += 1
+            seconds += len(sample['audio']['array']) / SAMPLE_RATE
+            if limit is not None and count >= limit:
+                break
+        elapsed = time.perf_counter() - start
+        return {'samples': count, 'elapsed': elapsed, 'samples_per_s': count / elapsed, 'audio_s_per_s': seconds / elapsed}
+
+    result = pd.DataFrame({'loose': measure(loose()), 'shards': measure(iter_shards(index_path))}).T
+    logger.info(f"Loader throughput\n{result}")
+    return result
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="pack split clips into shards, or benchmark loose files against shards")
+    parser.add_argument('dataset_path')
+    parser.add_argument('out_path')
+    parser.add_argument('--format', default='tar', choices=SHARD_FORMATS)
+    parser.add_argument('--codec', default='flac', choices=AUDIO_CODECS)
+    parser.add_argument('--shard-size', type=int, default=256 * 1024 * 1024)
+    parser.add_argument('--benchmark', action='store_true', help="benchmark loader throughput after packing")
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+    index = pack_shards(args.dataset_path, args.out_path, args.format, args.codec, args.shard_size)
+    if args.benchmark and index is not None:
+        benchmark_loading(args.dataset_path, index, args.limit)
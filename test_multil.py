@@ -13,10 +13,14 @@ if choice == '1':
         inserted, deleted = compare_texts_char_level_with_positions(text, final_text)
         print("Inserted characters:", inserted)
         print("Deleted characters:", deleted)
-    path = input("1: input text file or folder\n")
+    path = input("1: input text file, folder or corpus store (.sqlite3)\n")
     path = path.strip('"').strip("'")
     path = Path(path)
-    if path.is_dir():
+    if path.suffix == '.sqlite3':
+        from corpus import CorpusStore
+        with CorpusStore(path) as store:
+            print("Filtered scripts:", filter_onomatopoeia_from_corpus(store))
+    elif path.is_dir():
         for file in path.glob('*.txt'):
             remove_onomatopoia(file)
     else:
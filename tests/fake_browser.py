@@ -0,0 +1,100 @@
+"""
+Stand-in for playwright's async api backed by the fixture pages of bench_crawler, pages are served as a browser would render them
+"""
+import re
+from urllib.parse import urlparse, parse_qs
+
+from selectolax.lexbor import LexborHTMLParser
+
+from bench_crawler import fixture_page
+
+HAS_TEXT = re.compile(r"^(\w+):has-text\('(.+)'\)$")
+
+class FakeElement:
+    def __init__(self, node):
+        self.node = node
+
+    async def get_attribute(self, name):
+        return self.node.attributes.get(name)
+
+    async def text_content(self):
+        return self.node.text()
+
+class FakePage:
+    def __init__(self, browser):
+        self.browser = browser
+        self.tree = None
+        self.closed = False
+
+    def _select(self, selector):
+        match = HAS_TEXT.match(selector)
+        if match:
+            return [node for node in self.tree.css(match.group(1)) if match.group(2) in node.text()]
+        return self.tree.css(selector)
+
+    async def goto(self, url, timeout=None):
+        self.browser.navigations += 1
+        url = urlparse(url)
+        body = fixture_page(url.path, parse_qs(url.query), rendered=True)
+        if body is None:
+            raise RuntimeError(f"404 {url.path}")
+        self.tree = LexborHTMLParser(body.decode('utf-8'))
+
+    async def wait_for_load_state(self, state=None):
+        pass
+
+    async def wait_for_selector(self, selector, timeout=None):
+        if not self._select(selector):
+            raise TimeoutError(f"{selector} not found")
+
+    async def query_selector_all(self, selector):
+        return [FakeElement(node) for node in self._select(selector)]
+
+    async def query_selector(self, selector):
+        nodes = self._select(selector)
+        return FakeElement(nodes[0]) if nodes else None
+
+    async def is_visible(self, selector):
+        return bool(self._select(selector))
+
+    async def close(self):
+        self.closed = True
+
+class FakeBrowser:
+    def __init__(self):
+        self.pages = []
+        self.navigations = 0
+        self.closed = False
+
+    async def new_context(self):
+        return self
+
+    async def new_page(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+    async def close(self):
+        self.closed = True
+
+class FakePlaywright:
+    """
+    call it in place of async_playwright, `browsers` collects every launched browser
+    """
+    def __init__(self):
+        self.browsers = []
+        self.chromium = self
+
+    def __call__(self):
+        return self
+
+    async def start(self):
+        return self
+
+    async def launch(self):
+        browser = FakeBrowser()
+        self.browsers.append(browser)
+        return browser
+
+    async def stop(self):
+        pass
@@ -0,0 +1,49 @@
+from force_align import JapaneseTextAligner
+from segments import Segment, iter_segments, save
+
+def test_format_check_keeps_confidence_of_unedited_lines(tmp_path):
+    aligned = tmp_path / 'RJ00000001_track1.aligned.txt'
+    save([Segment(1.0, 3.5, '一行目です。', 1, 0.9), Segment(4.0, 6.0, '二行目です。', 2, 0.4), Segment(3700.0, 3702.0, '三行目です。', 3, 0.7)], aligned, 'aligned')
+    # the second line is corrected by hand
+    lines = aligned.read_text(encoding='utf-8').splitlines()
+    lines[1] = lines[1].replace('00:06.00', '00:06.50')
+    aligned.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    JapaneseTextAligner._format_check(aligned)
+    checked = list(iter_segments(tmp_path / 'RJ00000001_track1.ok.seg.jsonl'))
+    assert [(s.line_num, s.end, s.confidence) for s in checked] == [(1, 3.5, 0.9), (2, 6.5, None), (3, 3702.0, 0.7)]
+
+def test_unmatched_lines_get_no_invented_span():
+    aligner = JapaneseTextAligner()
+    asr = [Segment(1.0, 3.0, 'おはようございます'), Segment(4000.0, 4002.0, 'おやすみなさい')]
+    hypothesis, starts, ends = aligner._asr_timeline(asr)
+    lines = aligner._match_asr_lines(['おはようございます', '（小声）', 'おやすみなさい'], hypothesis, starts, ends)
+    assert [(line.start_time, line.end_time, line.confidence) for line in lines] == [(1.0, 3.0, 1.0), (3.0, 13.0, 0.0), (4000.0, 4002.0, 1.0)]
+    assert [line.matched for line in lines] == [True, False, True]
+
+def test_split_skips_only_unmatched_lines(tmp_path, monkeypatch, caplog):
+    import force_align
+    monkeypatch.setattr(force_align.subprocess, 'run', lambda cmd, **kwargs: None)
+    audio = tmp_path / 'RJ00000001_track1.mp3'
+    audio.write_bytes(b'')
+    # the last line is a TextGrid match with confidence 0, it has a real span and is kept
+    save([Segment(1.0, 3.0, 'おはようございます', 1, 1.0), Segment(3.0, 13.0, '（小声）', 2, 0.0, unmatched=True),
+          Segment(20.0, 22.0, 'おやすみなさい', 3, None), Segment(23.0, 25.0, 'ふぁ', 4, 0.0)],
+         audio.with_suffix('.ok.txt'), 'ok')
+    clips = force_align.split_audio(audio, tmp_path / 'dataset')
+    assert [clip.with_suffix('.txt').read_text(encoding='utf-8') for clip in clips] == ['おはようございます', 'おやすみなさい', 'ふぁ']
+    assert [record.message for record in caplog.records if 'Skip' in record.message] == ['Skip unmatched line 2 (00:03.00-00:13.00): （小声）']
+
+def test_unmatched_lines_reach_the_split_unless_timed_by_hand(tmp_path):
+    aligner = JapaneseTextAligner()
+    asr = [Segment(1.0, 3.0, 'おはようございます'), Segment(40.0, 42.0, 'おやすみなさい')]
+    hypothesis, starts, ends = aligner._asr_timeline(asr)
+    aligned = tmp_path / 'RJ00000001_track1.aligned.txt'
+    aligner._write_merged(aligner._match_asr_lines(['おはようございます', '（小声）', 'おやすみなさい'], hypothesis, starts, ends), aligned, aligned.stem, True)
+    assert [s.unmatched for s in iter_segments(aligned)] == [False, True, False]
+    JapaneseTextAligner._format_check(aligned)
+    assert [s.unmatched for s in iter_segments(tmp_path / 'RJ00000001_track1.ok.seg.jsonl')] == [False, True, False]
+    lines = aligned.read_text(encoding='utf-8').splitlines()
+    lines[1] = lines[1].replace('00:13.00', '00:05.00')
+    aligned.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    JapaneseTextAligner._format_check(aligned)
+    assert [s.unmatched for s in iter_segments(tmp_path / 'RJ00000001_track1.ok.seg.jsonl')] == [False, False, False]
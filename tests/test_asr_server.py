@@ -0,0 +1,85 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import numpy as np
+import pytest
+
+from asr_server import TranscriptionServer, stub_model, transcribe
+
+SEGMENT = np.zeros(16000, dtype=np.float32)
+
+def _metrics(server):
+    with urlopen(f"{server.url}/metrics", timeout=5) as response:
+        return json.loads(response.read())
+
+def test_concurrent_requests_are_batched():
+    with TranscriptionServer(stub_model(), port=0, max_batch_size=8, max_wait=0.2) as server:
+        with ThreadPoolExecutor(16) as pool:
+            results = list(pool.map(lambda _: transcribe(SEGMENT, server.url, timeout=10), range(16)))
+        metrics = _metrics(server)
+    assert all(result['text'].startswith('1.00s') for result in results)
+    assert metrics['requests'] == 16
+    assert metrics['mean_batch_size'] > 1
+
+def test_partial_batch_is_flushed_after_max_wait():
+    with TranscriptionServer(stub_model(batch_cost=0.0), port=0, max_batch_size=8, max_wait=0.1) as server:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(3) as pool:
+            results = list(pool.map(lambda _: transcribe(SEGMENT, server.url, timeout=10), range(3)))
+        elapsed = time.perf_counter() - start
+        metrics = _metrics(server)
+    assert len(results) == 3 and metrics['requests'] == 3
+    # the batch never fills up, it is sent when its first segment waited max_wait
+    assert metrics['batches'] >= 1 and metrics['mean_batch_size'] < 8
+    assert elapsed < 5
+
+def test_model_error_returns_500():
+    def model(batch):
+        raise RuntimeError("out of memory")
+    with TranscriptionServer(model, port=0, max_batch_size=4, max_wait=0.05) as server:
+        with pytest.raises(HTTPError) as error:
+            transcribe(SEGMENT, server.url, timeout=10)
+        assert error.value.code == 500
+        assert json.loads(error.value.read()) == {'error': "out of memory"}
+        assert _metrics(server)['errors'] == 1
+
+def test_segment_chunks_are_offset_to_the_audio(tmp_path):
+    from asr_server import transcribe_segments
+    from segments import Segment, save
+    class Cache:
+        def load(self, audio):
+            return np.zeros(16000 * 20, dtype=np.float32)
+    def model(batch):
+        return [{'text': 'あいう', 'chunks': [{'text': 'あ', 'timestamp': (0.0, 1.0)}, {'text': 'いう', 'timestamp': (1.0, None)}]} for _ in batch]
+    vad = tmp_path / 'work.vad.txt'
+    save([Segment(2.0, 4.0), Segment(10.0, 15.0)], vad, 'vad')
+    with TranscriptionServer(model, port=0) as server:
+        results = transcribe_segments(tmp_path / 'work.mp3', vad, server.url, pcm_cache=Cache())
+    assert [[tuple(chunk['timestamp']) for chunk in result['chunks']] for result in results] == [[(2.0, 3.0), (3.0, 4.0)], [(10.0, 11.0), (11.0, 15.0)]]
+
+def test_stop_fails_queued_items():
+    import threading
+    from asr_server import DynamicBatcher
+    started, release = threading.Event(), threading.Event()
+    def model(batch):
+        started.set()
+        release.wait(5)
+        return [{'text': ''} for _ in batch]
+    batcher = DynamicBatcher(model, max_batch_size=1, max_wait=0)
+    running = batcher.submit(SEGMENT)
+    assert started.wait(5)
+    queued = batcher.submit(SEGMENT)
+    stopper = threading.Thread(target=batcher.stop)
+    stopper.start()
+    while batcher.running:
+        time.sleep(0.01)
+    release.set()
+    stopper.join(5)
+    assert running.result(timeout=1) == {'text': ''}
+    with pytest.raises(RuntimeError, match="batcher stopped"):
+        queued.result(timeout=1)
+    with pytest.raises(RuntimeError, match="batcher stopped"):
+        batcher.submit(SEGMENT).result(timeout=1)
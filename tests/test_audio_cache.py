@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+
+import audio_cache
+from audio_cache import PCMCache
+
+SAMPLES = np.arange(40000, dtype=np.float32) / 40000
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """decode every source to SAMPLES in blocks instead of running ffmpeg, record the decoded paths"""
+    calls = []
+    def stream_pcm(audio, block_samples, sample_rate):
+        calls.append(audio)
+        for start in range(0, len(SAMPLES), 15000):
+            yield SAMPLES[start:start + 15000]
+    monkeypatch.setattr(audio_cache, 'stream_pcm', stream_pcm)
+    return calls
+
+@pytest.fixture
+def audio(tmp_path):
+    path = tmp_path / 'track1.mp3'
+    path.write_bytes(b'mp3')
+    return path
+
+def test_load_decodes_once(audio, decodes):
+    cache = PCMCache()
+    assert np.array_equal(cache.load(audio), SAMPLES)
+    assert np.array_equal(PCMCache().load(audio), SAMPLES)
+    assert decodes == [audio]
+
+def test_slice_and_blocks(audio, decodes):
+    cache = PCMCache()
+    assert np.array_equal(cache.slice(audio, 0.5, 1.0), SAMPLES[8000:16000])
+    assert np.array_equal(cache.slice(audio, 2.0, 10.0), SAMPLES[32000:])
+    assert len(cache.slice(audio, 1.0, 0.5)) == 0
+    blocks = list(cache.blocks(audio, 16000))
+    assert [len(block) for block in blocks] == [16000, 16000, 8000]
+    assert np.array_equal(np.concatenate(blocks), SAMPLES)
+
+def test_changed_source_is_decoded_again(audio, decodes):
+    cache = PCMCache()
+    cache.load(audio)
+    stat = audio.stat()
+    os.utime(audio, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.load(audio)
+    assert len(decodes) == 2
+    # only the entry of the current version is kept
+    assert sorted(path.suffix for path in (audio.parent / audio_cache.CACHE_DIR).iterdir()) == ['.f32', '.json']
+
+def test_failed_decode_leaves_no_partial_file(audio, monkeypatch):
+    def stream_pcm(audio, block_samples, sample_rate):
+        yield SAMPLES[:1000]
+        raise RuntimeError("ffmpeg failed")
+    monkeypatch.setattr(audio_cache, 'stream_pcm', stream_pcm)
+    with pytest.raises(RuntimeError):
+        PCMCache().load(audio)
+    assert list((audio.parent / audio_cache.CACHE_DIR).iterdir()) == []
@@ -0,0 +1,19 @@
+import json
+
+import pytest
+
+pytest.importorskip('neologdn')
+
+from bench_text import BASELINE, compare
+
+def _scaled(result, factor):
+    """result as run_benchmark returns it (int sizes), with every time multiplied by factor"""
+    return {**result,
+            'rounds': {stage: {int(size): [value * factor for value in values] for size, values in sizes.items()} for stage, sizes in result['rounds'].items()},
+            'normalized': {stage: {int(size): value * factor for size, value in sizes.items()} for stage, sizes in result['normalized'].items()}}
+
+def test_committed_baseline_catches_a_slowdown():
+    baseline = json.loads(BASELINE.read_text(encoding='utf-8'))
+    assert compare(_scaled(baseline, 1.0), baseline) == []
+    regressions = compare(_scaled(baseline, 2.0), baseline)
+    assert len(regressions) == len(baseline['normalized'])
@@ -0,0 +1,40 @@
+import pytest
+
+from corpus import CorpusStore
+
+SCRIPT = "おはようございます、ご主人様。\n今日はいいお天気ですね。"
+
+@pytest.fixture
+def store(tmp_path):
+    with CorpusStore(tmp_path / 'corpus.sqlite3') as store:
+        yield store
+
+def test_identical_texts_share_one_blob(store):
+    first = store.put('RJ00000001', 1, 'トラック1', SCRIPT)
+    assert store.put('RJ00000001', 2, 'トラック2', SCRIPT) == first
+    assert store.put('RJ00000002', 1, 'トラック1', SCRIPT, variant='filtered') == first
+    stats = store.stats()
+    assert (stats['works'], stats['scripts'], stats['unique_texts']) == (2, 3, 1)
+    store.delete_work('RJ00000001')
+    assert store.stats()['unique_texts'] == 1
+    store.delete_work('RJ00000002')
+    assert store.stats()['unique_texts'] == 0
+
+def test_export_then_import_reproduces_the_folder(store, tmp_path):
+    store.put('RJ00000001', 1, 'トラック1: 耳かき?', SCRIPT)
+    store.put('RJ00000001', 2, 'トラック2', SCRIPT + '\nおやすみなさい。')
+    store.put('RJ00000002', 1, 'トラック1', 'はい。')
+    store.put('RJ00000003', 1, '未完', 'まだ途中')
+    for rj_code in ('RJ00000001', 'RJ00000002'):
+        store.mark_complete(rj_code)
+    exported = tmp_path / 'exported'
+    # incomplete works are not exported
+    assert store.export_folder(exported) == 3
+    files = {path.relative_to(exported).as_posix(): path.read_text(encoding='utf-8') for path in exported.rglob('*.txt')}
+    assert sorted(files) == ['RJ00000001/1 トラック1 耳かき.txt', 'RJ00000001/2 トラック2.txt', 'RJ00000002/1 トラック1.txt']
+    with CorpusStore(tmp_path / 'imported.sqlite3') as imported:
+        assert imported.import_folder(exported) == 3
+        assert imported.rj_codes() == ['RJ00000001', 'RJ00000002']
+        reexported = tmp_path / 'reexported'
+        imported.export_folder(reexported)
+    assert {path.relative_to(reexported).as_posix(): path.read_text(encoding='utf-8') for path in reexported.rglob('*.txt')} == files
@@ -0,0 +1,128 @@
+import pytest
+
+pytest.importorskip('httpx')
+pytest.importorskip('selectolax')
+pytest.importorskip('playwright')
+
+from bench_crawler import FixtureServer, SCRIPTS_PER_WORK, WORKS_PER_PAGE
+from crawler_hvdb import scrape_rj_codes
+from corpus import CorpusStore, content_hash as corpus_hash
+from crawl_state import CrawlLedger, NO_JAPANESE, DONE, FAILED
+
+# list pages 1 and 2 list works 100-104 and 200-204, work 203 has an english only script
+WORKS = [page * 100 + i for page in (1, 2) for i in range(WORKS_PER_PAGE)]
+
+def _crawl(server, out_dir):
+    scrape_rj_codes(1, 2, base_url=server.url, out_dir=out_dir, fetch_mode='http')
+
+@pytest.fixture
+def crawled(tmp_path):
+    with FixtureServer(latency=0) as server:
+        _crawl(server, tmp_path)
+        yield server, tmp_path
+
+def test_script_texts_are_stored(crawled):
+    _, out_dir = crawled
+    with CorpusStore(out_dir / 'corpus.sqlite3') as corpus:
+        assert corpus.rj_codes() == [f'RJ{work:08d}' for work in WORKS if work % 7]
+        for work in WORKS:
+            if work % 7 == 0:
+                continue
+            records = list(corpus.iter_scripts(f'RJ{work:08d}'))
+            assert [record.idx for record in records] == list(range(1, SCRIPTS_PER_WORK + 1))
+            for record in records:
+                assert record.text == f"作品{work}のトラック{record.idx}です。\nおはようございます、ご主人様。"
+                assert record.source_url == f'/Dashboard/Script/{work}/{record.idx}'
+
+def test_works_without_japanese_are_recorded(crawled):
+    _, out_dir = crawled
+    with CrawlLedger(out_dir / 'crawl_state.sqlite3') as ledger:
+        for work in WORKS:
+            row = ledger.work(f'/Dashboard/Details/{work}')
+            assert row['status'] == (NO_JAPANESE if work % 7 == 0 else DONE)
+            assert row['rj_code'] == f'RJ{work:08d}'
+    with CorpusStore(out_dir / 'corpus.sqlite3') as corpus:
+        assert 'RJ00000203' not in corpus.rj_codes(complete_only=False)
+
+def test_second_run_makes_no_requests(crawled):
+    server, out_dir = crawled
+    server.requests = 0
+    _crawl(server, out_dir)
+    assert server.requests == 0
+
+@pytest.fixture
+def fake_playwright(monkeypatch):
+    import crawler_hvdb
+    from fake_browser import FakePlaywright
+    playwright = FakePlaywright()
+    monkeypatch.setattr(crawler_hvdb, 'async_playwright', playwright)
+    return playwright
+
+def test_english_only_script_needs_no_browser(tmp_path, fake_playwright):
+    with FixtureServer(latency=0) as server:
+        scrape_rj_codes(2, 2, base_url=server.url, out_dir=tmp_path, fetch_mode='auto')
+    assert fake_playwright.browsers == []
+    with CrawlLedger(tmp_path / 'crawl_state.sqlite3') as ledger:
+        assert ledger.work('/Dashboard/Details/203')['status'] == NO_JAPANESE
+
+def test_browser_mode_reuses_the_pooled_pages(tmp_path, fake_playwright):
+    with FixtureServer(latency=0) as server:
+        scrape_rj_codes(1, 1, base_url=server.url, out_dir=tmp_path, fetch_mode='browser', pool_size=2)
+        assert server.requests == 0
+    [browser] = fake_playwright.browsers
+    # one list page, then a details page, a script list and the scripts of each work
+    assert browser.navigations == 1 + WORKS_PER_PAGE * (2 + SCRIPTS_PER_WORK)
+    assert len(browser.pages) == 2 and all(page.closed for page in browser.pages) and browser.closed
+    with CorpusStore(tmp_path / 'corpus.sqlite3') as corpus:
+        assert corpus.rj_codes() == [f'RJ{work:08d}' for work in range(100, 100 + WORKS_PER_PAGE)]
+        assert corpus.get('RJ00000100', 2).text == "作品100のトラック2です。\nおはようございます、ご主人様。"
+
+def test_concurrent_crawl_is_faster():
+    from bench_crawler import benchmark_concurrency
+    serial, concurrent = benchmark_concurrency(pages=1, latency=0.05, settings=((1, 1, 1, 1), (8, 2, 4, 8)), fetch_mode='http')
+    assert serial['requests'] == concurrent['requests'] and serial['works'] == concurrent['works'] == WORKS_PER_PAGE
+    assert concurrent['pages_per_s'] > 2 * serial['pages_per_s']
+
+def _scrape_script(tmp_path, server, fetch_mode, script_href):
+    import asyncio
+    from crawler_hvdb import HvdbCrawler, HttpFetcher, PagePool
+    async def scrape():
+        async with HttpFetcher() as http, PagePool(1) as pool:
+            with CrawlLedger(tmp_path / 'crawl_state.sqlite3') as ledger, CorpusStore(tmp_path / 'corpus.sqlite3') as corpus:
+                crawler = HvdbCrawler(pool if fetch_mode == 'auto' else None, ledger, corpus, server.url, tmp_path, http=http)
+                status = await crawler.scrape_script(script_href, 1, 'トラック1', 'RJ00000110', '/Dashboard/Details/110')
+                record = corpus.get('RJ00000110', 1)
+                return status, ledger.script(script_href)['error'], record.text if record else None
+    return asyncio.run(scrape())
+
+def test_javascript_page_is_not_taken_for_english_only(tmp_path, fake_playwright):
+    with FixtureServer(latency=0) as server:
+        status, error, text = _scrape_script(tmp_path, server, 'http', '/Dashboard/Script/110/1')
+    assert status == FAILED and 'needs javascript' in error and text is None
+    assert fake_playwright.browsers == []
+
+def test_javascript_page_falls_back_to_the_browser(tmp_path, fake_playwright):
+    with FixtureServer(latency=0) as server:
+        status, error, text = _scrape_script(tmp_path, server, 'auto', '/Dashboard/Script/110/1')
+    assert status == DONE and text == "作品110のトラック1です。\nおはようございます、ご主人様。"
+    assert [browser.navigations for browser in fake_playwright.browsers] == [1]
+
+def test_refresh_stores_only_changed_scripts(crawled, monkeypatch):
+    import bench_crawler
+    server, out_dir = crawled
+    fixture_page = bench_crawler.fixture_page
+    def edited_page(path, query, rendered=False):
+        body = fixture_page(path, query, rendered)
+        return body.replace('ご主人様'.encode('utf-8'), 'お嬢様'.encode('utf-8')) if path == '/Dashboard/Script/101/2' else body
+    monkeypatch.setattr(bench_crawler, 'fixture_page', edited_page)
+    with CorpusStore(out_dir / 'corpus.sqlite3') as corpus:
+        before = dict(((rj, idx), at) for rj, idx, at in corpus.conn.execute("SELECT rj_code, idx, updated_at FROM scripts"))
+    server.requests = 0
+    scrape_rj_codes(1, 2, base_url=server.url, out_dir=out_dir, fetch_mode='http', refresh=True)
+    assert server.requests > 0
+    with CorpusStore(out_dir / 'corpus.sqlite3') as corpus:
+        after = dict(((rj, idx), at) for rj, idx, at in corpus.conn.execute("SELECT rj_code, idx, updated_at FROM scripts"))
+        assert corpus.get('RJ00000101', 2).text == "作品101のトラック2です。\nおはようございます、お嬢様。"
+    assert [key for key in before if after[key] != before[key]] == [('RJ00000101', 2)]
+    with CrawlLedger(out_dir / 'crawl_state.sqlite3') as ledger:
+        assert ledger.script('/Dashboard/Script/101/2')['content_hash'] == corpus_hash("作品101のトラック2です。\nおはようございます、お嬢様。")
@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('neologdn')
+
+from corpus import CorpusStore
+from dedup import index_near_duplicates, shingles
+
+SCRIPT = "おはようございます、ご主人様。今日はいいお天気ですね。お散歩に行きましょうか。"
+
+@pytest.fixture
+def store(tmp_path):
+    with CorpusStore(tmp_path / 'corpus.sqlite3') as store:
+        yield store
+
+def test_short_text_has_no_shingles():
+    assert len(shingles('あいう', 5)) == 0
+    assert len(shingles('あいうえお', 5)) == 1
+
+def test_short_texts_are_not_clustered(store):
+    for idx, text in enumerate(['', '……！？', '（小声）', 'はい。'], 1):
+        store.put('RJ00000001', idx, str(idx), text)
+        store.put('RJ00000002', idx, str(idx), text + '　')
+    store.put('RJ00000003', 1, '1', SCRIPT)
+    store.put('RJ00000004', 1, '1', SCRIPT)
+    for work in range(1, 5):
+        store.mark_complete(f'RJ{work:08d}')
+    assert index_near_duplicates(store) == [[('RJ00000003', 1), ('RJ00000004', 1)]]
+    assert store.canonical('RJ00000002', 1) is None
+    assert store.canonical('RJ00000004', 1)[:2] == ('RJ00000003', 1)
+
+def test_chained_keys_below_threshold_are_not_grouped():
+    import numpy as np
+    from dedup import LSHIndex
+    index = LSHIndex(threshold=0.7, num_perm=128)
+    a = np.arange(128, dtype=np.uint64)
+    b = a.copy()
+    b[:28] += 1000
+    c = b.copy()
+    c[100:] += 1000
+    for key, signature in (('a', a), ('b', b), ('c', c)):
+        index.add(key, signature)
+    # a ~ b and b ~ c at 0.78, but a and c only share 0.56 of their signature
+    assert index.similarity('a', 'c') < 0.7
+    assert index.clusters() == [['a', 'b']]
+    assert index.clusters(key=lambda key: key != 'c') == [['c', 'b']]
+
+def test_exact_duplicates_reuse_the_filtered_text(store, monkeypatch):
+    import onomato
+    monkeypatch.chdir(Path(onomato.__file__).parent)
+    for work in (1, 2):
+        store.put(f'RJ{work:08d}', 1, '1', SCRIPT)
+        store.mark_complete(f'RJ{work:08d}')
+    index_near_duplicates(store)
+    calls = []
+    filter_text = onomato.filter_onomatopoeia_from_text
+    monkeypatch.setattr(onomato, 'filter_onomatopoeia_from_text', lambda text, matcher: calls.append(text) or filter_text(text, matcher))
+    assert onomato.filter_onomatopoeia_from_corpus(store) == 2
+    assert len(calls) == 1
+    assert store.get('RJ00000002', 1, 'filtered').text == store.get('RJ00000001', 1, 'filtered').text
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+pytest.importorskip('pandas')
+
+import manifest
+from manifest import build_manifest
+
+@pytest.fixture
+def probed(monkeypatch):
+    """record the probed clips instead of reading audio headers"""
+    calls = []
+    def probe_audio(audio):
+        calls.append(audio.name)
+        return 1.5, 24000, 16000
+    monkeypatch.setattr(manifest, 'probe_audio', probe_audio)
+    return calls
+
+def _clip(dataset, name, text):
+    (dataset / f'{name}.mp3').write_bytes(b'mp3')
+    (dataset / f'{name}.txt').write_text(text, encoding='utf-8')
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_second_build_probes_only_new_or_changed_clips(tmp_path, probed, fmt):
+    for i in (1, 2, 3):
+        _clip(tmp_path, f'clip_{i}', f'{i}行目')
+    df = build_manifest(tmp_path, fmt=fmt, num_workers=2)
+    assert sorted(probed) == ['clip_1.mp3', 'clip_2.mp3', 'clip_3.mp3']
+    assert list(df['sentence']) == ['1行目', '2行目', '3行目']
+    probed.clear()
+    text = tmp_path / 'clip_2.txt'
+    text.write_text('二行目', encoding='utf-8')
+    stat = text.stat()
+    os.utime(text, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    (tmp_path / 'clip_3.mp3').unlink()
+    _clip(tmp_path, 'clip_4', '4行目')
+    df = build_manifest(tmp_path, fmt=fmt, num_workers=2)
+    assert sorted(probed) == ['clip_2.mp3', 'clip_4.mp3']
+    assert list(df['file_name']) == ['clip_1.mp3', 'clip_2.mp3', 'clip_4.mp3']
+    assert list(df['sentence']) == ['1行目', '二行目', '4行目']
+    probed.clear()
+    build_manifest(tmp_path, fmt=fmt, num_workers=2)
+    assert probed == []
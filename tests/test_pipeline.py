@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('neologdn')
+
+from corpus import CorpusStore
+from dedup import index_near_duplicates
+from pipeline import Orchestrator, Stage
+
+SCRIPT = "おはようございます、ご主人様。今日はいいお天気ですね。お散歩に行きましょうか。"
+
+def _copy(source: Path, target: Path):
+    target.write_bytes(source.read_bytes())
+
+def _stages():
+    return [Stage('copy', _copy, lambda audio: [audio], lambda audio: [audio.with_suffix('.out')], resource='gpu')]
+
+def _work(tmp_path, name, audio, script):
+    path = tmp_path / f'{name}.mp3'
+    path.write_bytes(audio)
+    path.with_suffix('.txt').write_text(script, encoding='utf-8')
+    return path
+
+def test_duplicate_works_of_the_same_recording_are_skipped(tmp_path):
+    with CorpusStore(tmp_path / 'corpus.sqlite3') as store:
+        for work in (1, 2, 3):
+            store.put(f'RJ{work:08d}', 1, '1', SCRIPT)
+            store.mark_complete(f'RJ{work:08d}')
+        index_near_duplicates(store)
+    audios = [_work(tmp_path, 'RJ00000001_track1', b'take 1', SCRIPT),
+              _work(tmp_path, 'RJ00000002_track1', b'take 1', SCRIPT),
+              _work(tmp_path, 'RJ00000003_track1', b'take 2', SCRIPT),
+              _work(tmp_path, 'RJ00000004_track1', b'take 1', 'コーパスにない台本')]
+    report = Orchestrator(_stages(), tmp_path / 'dataset', corpus=tmp_path / 'corpus.sqlite3').run(audios, manifest=False)
+    assert {name: status['copy'] for name, status in report.items()} == {
+        'RJ00000001_track1.mp3': 'built', 'RJ00000002_track1.mp3': 'duplicate', 'RJ00000003_track1.mp3': 'built', 'RJ00000004_track1.mp3': 'built'}
+    assert not audios[1].with_suffix('.out').exists()
+
+def test_orchestrator_runs_twice(tmp_path):
+    audio = _work(tmp_path, 'RJ00000001_track1', b'take 1', SCRIPT)
+    orchestrator = Orchestrator(_stages(), tmp_path / 'dataset')
+    assert orchestrator.run([audio], manifest=False)[audio.name] == {'copy': 'built'}
+    audio.write_bytes(b'take 2')
+    assert orchestrator.run([audio], manifest=False)[audio.name] == {'copy': 'built'}
+    assert audio.with_suffix('.out').read_bytes() == b'take 2'
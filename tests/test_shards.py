@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pandas')
+
+import manifest
+import shards
+from shards import iter_shards, pack_shards
+
+CLIP_SAMPLES = 1000
+
+def _waveform(i):
+    return (np.sin(np.arange(CLIP_SAMPLES) * (i + 1) / 50) * 0.5).astype(np.float32)
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """seven clips, each decodes to CLIP_SAMPLES samples of its own sine"""
+    dataset = tmp_path / 'dataset'
+    dataset.mkdir()
+    for i in range(7):
+        (dataset / f'clip_{i}.mp3').write_bytes(b'mp3')
+        (dataset / f'clip_{i}.txt').write_text(f'{i}行目です', encoding='utf-8')
+    monkeypatch.setattr(manifest, 'probe_audio', lambda audio: (CLIP_SAMPLES / 16000, CLIP_SAMPLES, 16000))
+    monkeypatch.setattr(shards, '_decode', lambda audio: _waveform(int(audio.stem.split('_')[1])))
+    return dataset
+
+@pytest.mark.parametrize('fmt, codec', [('tar', 'pcm'), ('tar', 'flac'), ('parquet', 'pcm')])
+def test_round_trip(dataset, tmp_path, fmt, codec):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    if codec == 'flac':
+        pytest.importorskip('soundfile')
+    index_path = pack_shards(dataset, tmp_path / 'shards', fmt, codec, shard_size=5000)
+    index = json.loads(index_path.read_text(encoding='utf-8'))
+    if codec == 'pcm':
+        # 16 bit pcm clips are 2000 bytes, a shard is closed once it holds 5000 bytes
+        assert [shard['num_samples'] for shard in index['shards']] == [3, 3, 1]
+    assert [shard['file'] for shard in index['shards']] == [f'shard-{i:05d}.{fmt}' for i in range(len(index['shards']))]
+    # every shard but the last reaches the size limit, and only with its last clip
+    for i, shard in enumerate(index['shards']):
+        sizes = [len(shards._encode(_waveform(int(sample['key'].split('_')[1])), codec)) for sample in iter_shards(index_path, shard_ids=[i])]
+        assert len(sizes) == shard['num_samples']
+        assert sum(sizes[:-1]) < 5000 and (sum(sizes) >= 5000 or i == len(index['shards']) - 1)
+    samples = list(iter_shards(index_path))
+    assert [sample['key'] for sample in samples] == [f'clip_{i}' for i in range(7)]
+    for i, sample in enumerate(samples):
+        assert sample['sentence'] == f'{i}行目です'
+        assert sample['meta'] == {'file_name': f'clip_{i}.mp3', 'num_samples': CLIP_SAMPLES, 'sampling_rate': 16000}
+        assert sample['audio']['sampling_rate'] == 16000
+        np.testing.assert_allclose(sample['audio']['array'], _waveform(i), atol=1 / 32767)
+    assert [sample['key'] for sample in iter_shards(tmp_path / 'shards', shard_ids=[0])] == [f'clip_{i}' for i in range(index['shards'][0]['num_samples'])]
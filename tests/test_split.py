@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import pytest
+
+import force_align
+from pipeline import run_split
+from segments import Segment, save
+
+@pytest.fixture
+def ffmpeg_calls(monkeypatch):
+    """record the ffmpeg commands and create their output file instead of encoding"""
+    calls = []
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        Path(cmd[-1]).write_bytes(b'')
+    monkeypatch.setattr(force_align.subprocess, 'run', run)
+    return calls
+
+def _work(tmp_path, lines):
+    audio = tmp_path / 'RJ00000001_track1.mp3'
+    audio.write_bytes(b'')
+    save([Segment(i * 5.0, i * 5.0 + 2.0, text, i) for i, text in enumerate(lines, 1)], audio.with_suffix('.ok.txt'), 'ok')
+    return audio
+
+def test_resplit_overwrites_and_removes_stale_clips(tmp_path, ffmpeg_calls):
+    dataset, marker = tmp_path / 'dataset', tmp_path / 'track1.split'
+    audio = _work(tmp_path, ['一行目', '二行目', '三行目'])
+    run_split(audio, audio.with_suffix('.ok.txt'), marker, dataset)
+    assert sorted(path.name for path in dataset.iterdir()) == [f'RJ00000001_track1_{n}{ext}' for n in (1, 2, 3) for ext in ('.mp3', '.txt')]
+    assert all('-y' in cmd for cmd in ffmpeg_calls)
+
+    audio = _work(tmp_path, ['一行目', '二行目'])
+    run_split(audio, audio.with_suffix('.ok.txt'), marker, dataset)
+    assert sorted(path.name for path in dataset.iterdir()) == [f'RJ00000001_track1_{n}{ext}' for n in (1, 2) for ext in ('.mp3', '.txt')]
+    assert marker.read_text(encoding='utf-8').splitlines() == ['RJ00000001_track1_1.mp3', 'RJ00000001_track1_2.mp3']
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from utils import SAMPLE_RATE, _merge_segments, energy_vad
+
+def _signal(*parts):
+    """concatenate (seconds, voiced) parts, voiced parts are a 220 Hz tone, the rest is faint noise"""
+    rng = np.random.default_rng(0)
+    chunks = []
+    for seconds, voiced in parts:
+        n = int(seconds * SAMPLE_RATE)
+        chunk = rng.normal(0, 1e-3, n)
+        if voiced:
+            chunk += 0.5 * np.sin(2 * np.pi * 220 * np.arange(n) / SAMPLE_RATE)
+        chunks.append(chunk)
+    return np.concatenate(chunks).astype(np.float32)
+
+def _close(ranges, expected, tolerance=0.03):
+    return len(ranges) == len(expected) and all(abs(a - b) <= tolerance for r, e in zip(ranges, expected) for a, b in zip(r, e))
+
+def test_tone_between_silences_is_detected():
+    ranges = energy_vad(_signal((1.0, False), (1.0, True), (1.0, False)))
+    assert _close(ranges, [(1.0, 2.0)]), ranges
+
+def test_short_gaps_are_filled_and_short_regions_dropped():
+    # the 0.1 s gap is below min_duration_off, the 0.1 s blip is below min_duration_on
+    signal = _signal((1.0, False), (0.5, True), (0.1, False), (0.4, True), (1.0, False), (0.1, True), (1.0, False))
+    assert _close(energy_vad(signal), [(1.0, 2.0)])
+    # with lower minimums the gap splits the region and the blip is kept
+    assert _close(energy_vad(signal, min_duration_off=0.05, min_duration_on=0.05), [(1.0, 1.5), (1.6, 2.0), (3.0, 3.1)])
+
+def test_silence_has_no_voice():
+    assert energy_vad(_signal((2.0, False))) == []
+    assert energy_vad(np.zeros(100, dtype=np.float32)) == []
+
+@pytest.mark.parametrize('segments, max_length, max_gap, expected', [
+    ([], 25.0, 6.0, []),
+    ([(0.0, 1.0), (2.0, 3.0), (10.0, 11.0)], 25.0, 6.0, [(0.0, 3.0), (10.0, 11.0)]),
+    ([(0.0, 10.0), (11.0, 20.0), (21.0, 30.0)], 25.0, 6.0, [(0.0, 20.0), (21.0, 30.0)]),
+])
+def test_merge_segments(segments, max_length, max_gap, expected):
+    assert _merge_segments(segments, max_length, max_gap) == expected
+
+def test_windowed_detection_matches_whole_file(tmp_path, monkeypatch):
+    import utils
+    from utils import VoiceDetector
+    # windows start every 3 s, the core boundaries are at 3.5, 6.5 and 9.5 s, the second tone crosses one
+    signal = _signal((1.0, False), (1.0, True), (1.0, False), (2.0, True), (2.0, False), (1.5, True), (3.5, False))
+    monkeypatch.setattr(utils, 'stream_pcm', lambda audio, block_samples, sample_rate=SAMPLE_RATE: (
+        signal[start:start + block_samples] for start in range(0, len(signal), block_samples)))
+    whole = energy_vad(signal)
+    assert _close(whole, [(1.0, 2.0), (3.0, 5.0), (7.0, 8.5)])
+    windowed = VoiceDetector('energy', window=4.0, overlap=1.0).detect(tmp_path / 'track1.mp3')
+    assert _close(windowed, whole, tolerance=0.02), windowed
+    assert _close(VoiceDetector('energy', window=60.0, overlap=1.0).detect(tmp_path / 'track1.mp3'), whole, tolerance=0.001)
@@ -4,8 +4,8 @@ import regex as re
 basicConfig(level=DEBUG)
 logger = getLogger(__name__)    
 
-import pandas as pd
 from pathlib import Path
+from segments import Segment, save
 def metadata_csv(dataset_path: str | Path):
     """
     Generate metadata.csv for dataset with pandas
@@ -24,55 +24,228 @@ def metadata_csv(dataset_path: str | Path):
     |   |-- audio3.mp3
     |   |-- audio4.mp3
     |   |-- ...
+    The sidecar '.txt' transcripts are kept and only new or changed clips are read again, see manifest.ManifestBuilder for jsonl/parquet output.
     """
-    dataset_path = Path(dataset_path)
-    if not dataset_path.exists():
-        return
-    
-    metadatas = []
-    texts = []
-    for audio in dataset_path.glob('*.mp3'):
-        text = audio.with_suffix('.txt')
-        if not text.exists():
-            continue
-        content = text.read_text(encoding='utf-8')
-        metadatas.append((f"'{audio.name}'", f"'{content}'"))
-        text.unlink()
-    pd.DataFrame(metadatas, columns=['file_name', 'sentence']).to_csv(dataset_path / 'metadata.csv', index=False)
-
-def voice_detection(audio : str | Path):
+    from manifest import build_manifest
+    return build_manifest(dataset_path, fmt='csv')
+
+MAX_LENGTH = 25.0
+MAX_GAP = 6.0
+SAMPLE_RATE = 16000
+
+def _merge_segments(segments, max_length: float = MAX_LENGTH, max_gap: float = MAX_GAP):
+    """
+    Merge (start, end) voice ranges into chunks, a new chunk starts when the gap to previous range exceeds max_gap or the chunk would exceed max_length
+    """
+    segments = list(segments)
+    if len(segments) == 0:
+        return []
+    start_time, end_time = segments[0]
+    final_segments = []
+    for start, end in segments[1:]:
+        if start - end_time > max_gap or end - start_time > max_length:
+            final_segments.append((start_time, end_time))
+            start_time = start
+            end_time = end
+        else:
+            end_time = end
+    final_segments.append((start_time, end_time))
+    return final_segments
+
+def energy_vad(waveform, sample_rate: int = SAMPLE_RATE, frame_length: float = 0.025, hop_length: float = 0.010,
+               onset: float = 12.0, offset: float = 6.0, max_zcr: float = 0.25,
+               min_duration_on: float = 0.25, min_duration_off: float = 0.30):
+    """
+    Vectorized energy + zero-crossing voice activity detection, return list of (start, end) seconds.
+    onset/offset are hysteresis thresholds in dB above the estimated noise floor, a region starts when energy exceeds onset and lasts while it stays above offset.
+    frames quieter than onset with zero-crossing rate above max_zcr are treated as noise.
+    gaps shorter than min_duration_off are filled, then regions shorter than min_duration_on are dropped.
+    """
+    import numpy as np
+    waveform = np.asarray(waveform, dtype=np.float32)
+    if waveform.ndim > 1:
+        waveform = waveform.mean(axis=0)
+    frame = int(frame_length * sample_rate)
+    hop = int(hop_length * sample_rate)
+    if len(waveform) < frame:
+        return []
+    frames = np.lib.stride_tricks.sliding_window_view(waveform, frame)[::hop]
+    energy = 10.0 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    zcr = np.mean(np.abs(np.diff(np.signbit(frames), axis=1)), axis=1)
+    noise_floor = np.percentile(energy, 10)
+    above_on = energy > noise_floor + onset
+    above_off = (energy > noise_floor + offset) & ((zcr <= max_zcr) | above_on)
+
+    # hysteresis: keep runs above offset which contain at least one frame above onset
+    padded = np.concatenate(([False], above_off, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    run_starts, run_ends = edges[::2], edges[1::2]
+    if len(run_starts) == 0:
+        return []
+    has_onset = np.add.reduceat(above_on, run_starts) > 0
+    run_starts, run_ends = run_starts[has_onset], run_ends[has_onset]
+    if len(run_starts) == 0:
+        return []
+
+    starts = run_starts * hop / sample_rate
+    ends = ((run_ends - 1) * hop + frame) / sample_rate
+    # fill short gaps, then drop short regions
+    keep_gap = np.concatenate(([True], starts[1:] - ends[:-1] >= min_duration_off))
+    starts = starts[keep_gap]
+    ends = np.maximum.reduceat(ends, np.flatnonzero(keep_gap))
+    long_enough = ends - starts >= min_duration_on
+    return [(float(s), float(e)) for s, e in zip(starts[long_enough], ends[long_enough])]
+
+def stream_pcm(audio: Path, block_samples: int, sample_rate: int = SAMPLE_RATE):
+    """
+    Decode audio with ffmpeg to mono float32 PCM and yield it in blocks of block_samples, memory use is bounded by the block size
+    """
+    import numpy as np
+    import subprocess
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", str(audio), "-loglevel", "error", "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-"
+    ]
+    block_bytes = block_samples * 4
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {audio}")
+
+class VoiceDetector:
+    """
+    Reusable voice activity detector, the backend is loaded once and shared by every file.
+    Audio is decoded in overlapping windows of `window` seconds with `overlap` seconds shared between neighbours, each window only keeps
+    the segments inside its core region (the half overlaps belong to its neighbours), pieces that touch at the core boundaries are stitched back together.
+    backend is 'pyannote' (pretrained model) or 'energy' (offline numpy energy/zero-crossing detector, vad_kwargs are passed to energy_vad).
+    pcm_cache: audio_cache.PCMCache to read windows from the memory-mapped decoded audio shared with later stages, None streams from ffmpeg.
+    """
+    BACKENDS = ('pyannote', 'energy')
+
+    def __init__(self, backend: str = 'pyannote', window: float = 600.0, overlap: float = 10.0,
+                 max_length: float = MAX_LENGTH, max_gap: float = MAX_GAP, pcm_cache=None, **vad_kwargs):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown VAD backend {backend}, choose from {list(self.BACKENDS)}")
+        if overlap >= window:
+            raise ValueError("overlap must be shorter than window")
+        self.backend = backend
+        self.window = window
+        self.overlap = overlap
+        self.max_length = max_length
+        self.max_gap = max_gap
+        self.pcm_cache = pcm_cache
+        self.vad_kwargs = vad_kwargs
+        self.pipeline = self._load_pipeline() if backend == 'pyannote' else None
+
+    def _load_pipeline(self):
+        from pyannote.audio import Pipeline
+        return Pipeline.from_pretrained("pyannote/voice-activity-detection")
+
+    def _detect_window(self, waveform):
+        if self.backend == 'energy':
+            return energy_vad(waveform, sample_rate=SAMPLE_RATE, **self.vad_kwargs)
+        import torch
+        output = self.pipeline({"waveform": torch.from_numpy(waveform).unsqueeze(0), "sample_rate": SAMPLE_RATE})
+        return [(segment.start, segment.end) for segment in output.get_timeline().support()]
+
+    def _windows(self, audio: Path):
+        """
+        yield (offset_seconds, waveform, is_last) windows, each one shares `overlap` seconds with the previous window
+        """
+        import numpy as np
+        window = int(self.window * SAMPLE_RATE)
+        overlap = int(self.overlap * SAMPLE_RATE)
+        buffer = np.zeros(0, dtype=np.float32)
+        offset = 0
+        pending = None
+        blocks = stream_pcm(audio, window - overlap) if self.pcm_cache is None else self.pcm_cache.blocks(audio, window - overlap)
+        for block in blocks:
+            buffer = np.concatenate((buffer, block))
+            if len(buffer) < window:
+                continue
+            # hold one window back, so the last one is known when the stream ends
+            if pending is not None:
+                yield pending[0], pending[1], False
+            pending = (offset / SAMPLE_RATE, buffer[:window])
+            offset += window - overlap
+            buffer = buffer[window - overlap:]
+        if pending is None:
+            yield 0.0, buffer, True
+        elif len(buffer) > overlap:
+            yield pending[0], pending[1], False
+            yield offset / SAMPLE_RATE, buffer, True
+        else:
+            yield pending[0], pending[1], True
+
+    def detect(self, audio: str | Path):
+        """
+        return raw (start, end) voice ranges in seconds for the whole file
+        """
+        audio = Path(audio)
+        half = self.overlap / 2
+        pieces = []
+        first = True
+        for offset, waveform, is_last in self._windows(audio):
+            core_start = offset if first else offset + half
+            core_end = float('inf') if is_last else offset + len(waveform) / SAMPLE_RATE - half
+            for start, end in self._detect_window(waveform):
+                start, end = max(start + offset, core_start), min(end + offset, core_end)
+                if end > start:
+                    pieces.append((start, end))
+            first = False
+        # stitch the pieces cut at window core boundaries
+        segments = []
+        for start, end in pieces:
+            if segments and start - segments[-1][1] < 1e-3:
+                segments[-1] = (segments[-1][0], max(end, segments[-1][1]))
+            else:
+                segments.append((start, end))
+        return segments
+
+    def __call__(self, audio: str | Path, label_txt: str | Path = None):
+        """
+        Detect voice in audio file and write merged voice ranges as segments (label_txt with '.seg.jsonl' extension) and their text view
+        to label_txt (default: audio with '.txt' extension), each line contains start, end timestamps, labels.
+        Both files are replaced atomically, reruns don't duplicate lines. Return the label file path, None if no voice found.
+        """
+        audio = Path(audio)
+        if not audio.exists():
+            return
+        label_txt = audio.with_suffix('.txt') if label_txt is None else Path(label_txt)
+        final_segments = _merge_segments(self.detect(audio), self.max_length, self.max_gap)
+        if not final_segments:
+            return
+        save([Segment(start, end, f'{label_txt.stem}_{i}', i, source=audio.name) for i, (start, end) in enumerate(final_segments, 1)], label_txt, 'vad')
+        return label_txt
+
+    def process_dir(self, folder: str | Path, pattern: str = '*.mp3'):
+        """
+        Run detection on every audio file in folder with the already loaded backend
+        """
+        labels = []
+        for audio in sorted(Path(folder).glob(pattern)):
+            logger.info(f"Voice detection {audio}")
+            try:
+                labels.append(self(audio))
+            except Exception as e:
+                logger.error(f"Voice detection failed for {audio}: {e}")
+        return labels
+
+def voice_detection(audio : str | Path, backend: str = 'pyannote', **vad_kwargs):
     """
     Detect voice in audio file, return the detected voice ranges in txt format, each line contains start, end timestamps, labels.
+    One-off helper, use VoiceDetector directly to reuse the loaded backend across files.
     """
     audio = Path(audio)
     if not audio.exists():
         return
     try:
-        from pyannote.audio import Pipeline
-    except Exception as e:
+        detector = VoiceDetector(backend, **vad_kwargs)
+    except ImportError as e:
         logger.error(e)
         return
-    MAX_LENGTH = 25.0
-    MAX_GAP = 6.0
-    label_txt = audio.with_suffix('.txt')
-    initial_segments = []
-    pipeline = Pipeline.from_pretrained("pyannote/voice-activity-detection")
-    output = pipeline(audio)
-    for segment in output.get_timeline().support():
-        initial_segments.append(segment)
-    if len(initial_segments) == 0:
-        return
-    start_time = initial_segments[0].start
-    end_time = initial_segments[0].end
-    final_segments = []
-    for segment in initial_segments[1:]:
-        if segment.start - end_time > MAX_GAP or segment.end - start_time > MAX_LENGTH:
-            final_segments.append((start_time, end_time))
-            start_time = segment.start
-            end_time = segment.end
-        else:
-            end_time = segment.end
-    final_segments.append((start_time, end_time))
-    with open(label_txt, 'a', encoding='utf-8') as f:
-        for i, (start, end) in enumerate(final_segments, 1):
-            f.write(f'{start:.2f}\t{end:.2f}\t{label_txt.stem}_{i}\n')
+    return detector(audio)